@@ -0,0 +1,448 @@
+/*
+ * _elospeedups
+ * ~~~~~~~~~~~~
+ *
+ * C implementations of the "E" function and the adjustment of Elo with or
+ * without an expectation table. They compute the same floating point
+ * operations in the same order as the pure Python implementations in elo.py,
+ * so the results agree bit for bit. It also has the replay loop of elofit.
+ *
+ * :copyright: (c) 2012 by Heungsub Lee
+ * :license: BSD, see LICENSE for more details.
+ */
+#include <Python.h>
+#include <errno.h>
+#include <math.h>
+#include <string.h>
+
+
+/* Same as float(obj). */
+static int
+as_double(PyObject *obj, double *result)
+{
+    PyObject *f;
+    if (PyFloat_CheckExact(obj)) {
+        *result = PyFloat_AS_DOUBLE(obj);
+        return 0;
+    }
+    f = PyNumber_Float(obj);
+    if (f == NULL)
+        return -1;
+    *result = PyFloat_AS_DOUBLE(f);
+    Py_DECREF(f);
+    return 0;
+}
+
+
+/* Same as 1. / (1 + 10 ** (diff / f_factor)). 10 ** x raises OverflowError
+ * like float.__pow__ when the result overflows. */
+static int
+expect(double diff, double f_factor, double *result)
+{
+    double x = diff / f_factor, power;
+    errno = 0;
+    power = pow(10., x);
+    if (Py_IS_INFINITY(power) && Py_IS_FINITE(x)) {
+        errno = ERANGE;
+        PyErr_SetFromErrno(PyExc_OverflowError);
+        return -1;
+    }
+    *result = 1. / (1 + power);
+    return 0;
+}
+
+
+/* An expectation table. See elo.ExpectTable. */
+typedef struct {
+    Py_buffer view;
+    const double *values;
+    Py_ssize_t last;
+    double scale, offset;
+    int interpolate;
+} table_t;
+
+
+/* Same as elo.ExpectTable.expect(diff), or expect() without a table. */
+static int
+lookup(const table_t *table, double diff, double f_factor, double *result)
+{
+    double pos, lower;
+    Py_ssize_t x;
+    if (table == NULL)
+        return expect(diff, f_factor, result);
+    pos = diff * table->scale + table->offset;
+    if (!(pos >= 0 && pos <= table->last))
+        return expect(diff, f_factor, result);
+    if (!table->interpolate) {
+        *result = table->values[(Py_ssize_t)(pos + 0.5)];
+        return 0;
+    }
+    x = (Py_ssize_t)pos;
+    if (x == table->last)
+        --x;
+    lower = table->values[x];
+    *result = lower + (table->values[x + 1] - lower) * (pos - (double)x);
+    return 0;
+}
+
+
+static int get_buffer(PyObject *, Py_buffer *, Py_ssize_t, const char *);
+
+
+/* Gets the table of the optional arguments. Returns NULL without an error if
+ * there is no table. */
+static table_t *
+get_table(table_t *table, PyObject *values, double scale, double offset,
+          int interpolate)
+{
+    if (values == NULL || values == Py_None)
+        return NULL;
+    if (get_buffer(values, &table->view, sizeof(double), "d") < 0)
+        return NULL;
+    table->values = (const double *)table->view.buf;
+    table->last = table->view.len / (Py_ssize_t)sizeof(double) - 1;
+    if (table->last < 1) {
+        PyErr_SetString(PyExc_ValueError, "the table is too small");
+        PyBuffer_Release(&table->view);
+        return NULL;
+    }
+    table->scale = scale;
+    table->offset = offset;
+    table->interpolate = interpolate;
+    return table;
+}
+
+
+PyDoc_STRVAR(expect_doc,
+"expect(rating, other_rating, f_factor[, table, scale, offset, interpolate])\n\n\
+The same as :meth:`elo.Elo.expect`. The optional arguments are the\n\
+``array('d')`` of an :class:`elo.ExpectTable` and its lookup parameters.");
+
+static PyObject *
+speedups_expect(PyObject *self, PyObject *args)
+{
+    PyObject *rating, *other_rating, *values = NULL;
+    double value, other_value, f_factor, result, scale = 1., offset = 0.;
+    int interpolate = 1, failed;
+    table_t table_data, *table;
+    if (!PyArg_ParseTuple(args, "OOd|Oddi:expect", &rating, &other_rating,
+                          &f_factor, &values, &scale, &offset, &interpolate))
+        return NULL;
+    table = get_table(&table_data, values, scale, offset, interpolate);
+    if (table == NULL && PyErr_Occurred())
+        return NULL;
+    failed = as_double(other_rating, &other_value) < 0 ||
+             as_double(rating, &value) < 0 ||
+             lookup(table, other_value - value, f_factor, &result) < 0;
+    if (table != NULL)
+        PyBuffer_Release(&table->view);
+    if (failed)
+        return NULL;
+    return PyFloat_FromDouble(result);
+}
+
+
+PyDoc_STRVAR(adjust_doc,
+"adjust(rating, series, f_factor[, table, scale, offset, interpolate])\n\n\
+The same as :meth:`elo.Elo.adjust`. See expect() for the optional\n\
+arguments. The sum follows the algorithm of the built-in sum() of the\n\
+running Python.");
+
+static PyObject *
+speedups_adjust(PyObject *self, PyObject *args)
+{
+    PyObject *rating, *series, *iter, *item, *pair, *score, *other_rating;
+    PyObject *values = NULL, *result = NULL;
+    double value, other_value, f_factor, score_value, e, x, total = 0.;
+    double compensation = 0., scale = 1., offset = 0.;
+    int empty = 1, interpolate = 1;
+    table_t table_data, *table;
+    if (!PyArg_ParseTuple(args, "OOd|Oddi:adjust", &rating, &series,
+                          &f_factor, &values, &scale, &offset, &interpolate))
+        return NULL;
+    table = get_table(&table_data, values, scale, offset, interpolate);
+    if (table == NULL && PyErr_Occurred())
+        return NULL;
+    if (as_double(rating, &value) < 0)
+        goto done;
+    iter = PyObject_GetIter(series);
+    if (iter == NULL)
+        goto done;
+    while ((item = PyIter_Next(iter)) != NULL) {
+        pair = PySequence_Tuple(item);
+        Py_DECREF(item);
+        if (pair == NULL)
+            goto error;
+        if (PyTuple_GET_SIZE(pair) != 2) {
+            /* the same errors as unpacking */
+            if (PyTuple_GET_SIZE(pair) < 2)
+                PyErr_Format(PyExc_ValueError, "not enough values to unpack "
+                             "(expected 2, got %d)",
+                             (int)PyTuple_GET_SIZE(pair));
+            else
+                PyErr_SetString(PyExc_ValueError,
+                                "too many values to unpack (expected 2)");
+            Py_DECREF(pair);
+            goto error;
+        }
+        score = PyTuple_GET_ITEM(pair, 0);
+        other_rating = PyTuple_GET_ITEM(pair, 1);
+        if (as_double(other_rating, &other_value) < 0 ||
+            lookup(table, other_value - value, f_factor, &e) < 0 ||
+            as_double(score, &score_value) < 0) {
+            Py_DECREF(pair);
+            goto error;
+        }
+        Py_DECREF(pair);
+        x = score_value - e;
+        if (empty) {
+            /* sum() starts with the integer 0 */
+            total = 0. + x;
+            empty = 0;
+            continue;
+        }
+#if PY_VERSION_HEX >= 0x030C0000
+        /* sum() of floats is compensated by Neumaier's algorithm since
+         * Python 3.12 */
+        {
+            double t = total + x;
+            if (fabs(total) >= fabs(x))
+                compensation += (total - t) + x;
+            else
+                compensation += (x - t) + total;
+            total = t;
+        }
+#else
+        total += x;
+#endif
+    }
+    Py_DECREF(iter);
+    if (PyErr_Occurred())
+        goto done;
+    if (empty) {
+#if PY_MAJOR_VERSION >= 3
+        result = PyLong_FromLong(0);
+#else
+        result = PyInt_FromLong(0);
+#endif
+        goto done;
+    }
+    if (compensation && Py_IS_FINITE(compensation))
+        total += compensation;
+    result = PyFloat_FromDouble(total);
+    goto done;
+error:
+    Py_DECREF(iter);
+done:
+    if (table != NULL)
+        PyBuffer_Release(&table->view);
+    return result;
+}
+
+
+/* Gets a C-contiguous buffer of the item size and one of the type codes.
+ * An int32 buffer is 'l' instead of 'i' where long is 4 bytes, such as
+ * NumPy on Windows, so the codes of an integer size are all accepted. */
+static int
+get_buffer(PyObject *obj, Py_buffer *view, Py_ssize_t itemsize,
+           const char *codes)
+{
+    const char *format;
+    char code;
+    if (PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0)
+        return -1;
+    format = view->format == NULL ? "B" : view->format;
+    code = format[strlen(format) - 1];
+    if (view->itemsize != itemsize || code == '\0' ||
+        strchr(codes, code) == NULL) {
+        PyErr_Format(PyExc_TypeError, "expected a buffer of %d-byte '%s'",
+                     (int)itemsize, codes);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+
+/* Gets a double array of a sequence. */
+static double *
+as_doubles(PyObject *seq, Py_ssize_t *size)
+{
+    PyObject *fast = PySequence_Fast(seq, "expected a sequence");
+    double *result;
+    Py_ssize_t x;
+    if (fast == NULL)
+        return NULL;
+    *size = PySequence_Fast_GET_SIZE(fast);
+    result = PyMem_New(double, *size + 1);
+    if (result == NULL) {
+        Py_DECREF(fast);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (x = 0; x < *size; ++x) {
+        if (as_double(PySequence_Fast_GET_ITEM(fast, x), &result[x]) < 0) {
+            PyMem_Free(result);
+            Py_DECREF(fast);
+            return NULL;
+        }
+    }
+    Py_DECREF(fast);
+    return result;
+}
+
+
+PyDoc_STRVAR(replay_doc,
+"replay(player_ids1, player_ids2, scores, players, initial, beta, bounds,\n\
+       k_factors, provisional_k, provisional_games, start)\n\n\
+Replays 1 vs 1 games on rating values and scores the expected scores of the\n\
+games from ``start`` before they are rated. The player ids are buffers of\n\
+int32 and the scores are a buffer of doubles. The K-factor of a rating is\n\
+``provisional_k`` if the player has played less than ``provisional_games``\n\
+games, otherwise ``k_factors[i]`` where ``i`` is the number of the bounds\n\
+which the rating reaches. Returns the sums of the log-losses and the Brier\n\
+scores and the number of the scored games.");
+
+static PyObject *
+speedups_replay(PyObject *self, PyObject *args)
+{
+    PyObject *ids1_obj, *ids2_obj, *scores_obj, *bounds_obj, *ks_obj;
+    Py_buffer ids1_view, ids2_view, scores_view;
+    Py_ssize_t players, start, size, nbounds, nks, x, y;
+    double initial, beta, provisional_k, f_factor;
+    double *values = NULL, *bounds = NULL, *ks = NULL;
+    double log_loss = 0., brier = 0.;
+    long provisional_games, *times = NULL, count = 0;
+    const int *ids1, *ids2;
+    const double *scores;
+    int out_of_range = 0;
+    PyObject *result = NULL;
+    if (!PyArg_ParseTuple(args, "OOOnddOOdln:replay", &ids1_obj, &ids2_obj,
+                          &scores_obj, &players, &initial, &beta,
+                          &bounds_obj, &ks_obj, &provisional_k,
+                          &provisional_games, &start))
+        return NULL;
+    if (get_buffer(ids1_obj, &ids1_view, sizeof(int), "ilq") < 0)
+        return NULL;
+    if (get_buffer(ids2_obj, &ids2_view, sizeof(int), "ilq") < 0) {
+        PyBuffer_Release(&ids1_view);
+        return NULL;
+    }
+    if (get_buffer(scores_obj, &scores_view, sizeof(double), "d") < 0) {
+        PyBuffer_Release(&ids1_view);
+        PyBuffer_Release(&ids2_view);
+        return NULL;
+    }
+    size = scores_view.len / (Py_ssize_t)sizeof(double);
+    if (ids1_view.len / (Py_ssize_t)sizeof(int) != size ||
+        ids2_view.len / (Py_ssize_t)sizeof(int) != size) {
+        PyErr_SetString(PyExc_ValueError,
+                        "the buffers must be the same length");
+        goto done;
+    }
+    bounds = as_doubles(bounds_obj, &nbounds);
+    if (bounds == NULL)
+        goto done;
+    ks = as_doubles(ks_obj, &nks);
+    if (ks == NULL)
+        goto done;
+    if (nks != nbounds + 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "k_factors must be one more than the bounds");
+        goto done;
+    }
+    values = PyMem_New(double, players + 1);
+    times = PyMem_New(long, players + 1);
+    if (values == NULL || times == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (x = 0; x < players; ++x) {
+        values[x] = initial;
+        times[x] = 0;
+    }
+    ids1 = (const int *)ids1_view.buf;
+    ids2 = (const int *)ids2_view.buf;
+    scores = (const double *)scores_view.buf;
+    f_factor = 2 * beta;
+    Py_BEGIN_ALLOW_THREADS
+    for (x = 0; x < size; ++x) {
+        int player1 = ids1[x], player2 = ids2[x];
+        double value1, value2, expect1, expect2, score = scores[x], k1, k2;
+        if (player1 < 0 || player1 >= players ||
+            player2 < 0 || player2 >= players) {
+            out_of_range = 1;
+            break;
+        }
+        value1 = values[player1];
+        value2 = values[player2];
+        expect1 = 1. / (1 + pow(10., (value2 - value1) / f_factor));
+        expect2 = 1. / (1 + pow(10., (value1 - value2) / f_factor));
+        if (x >= start) {
+            double e = expect1 < 1e-15 ? 1e-15 :
+                       expect1 > 1 - 1e-15 ? 1 - 1e-15 : expect1;
+            log_loss -= score * log(e) + (1 - score) * log(1 - e);
+            brier += (expect1 - score) * (expect1 - score);
+            ++count;
+        }
+        if (times[player1] < provisional_games) {
+            k1 = provisional_k;
+        } else {
+            for (y = 0; y < nbounds && value1 >= bounds[y]; ++y);
+            k1 = ks[y];
+        }
+        if (times[player2] < provisional_games) {
+            k2 = provisional_k;
+        } else {
+            for (y = 0; y < nbounds && value2 >= bounds[y]; ++y);
+            k2 = ks[y];
+        }
+        values[player1] = value1 + k1 * (score - expect1);
+        values[player2] = value2 + k2 * ((1 - score) - expect2);
+        ++times[player1];
+        ++times[player2];
+    }
+    Py_END_ALLOW_THREADS
+    if (out_of_range) {
+        PyErr_SetString(PyExc_IndexError, "player id out of range");
+        goto done;
+    }
+    result = Py_BuildValue("ddl", log_loss, brier, count);
+done:
+    PyMem_Free(values);
+    PyMem_Free(times);
+    PyMem_Free(bounds);
+    PyMem_Free(ks);
+    PyBuffer_Release(&ids1_view);
+    PyBuffer_Release(&ids2_view);
+    PyBuffer_Release(&scores_view);
+    return result;
+}
+
+
+static PyMethodDef speedups_methods[] = {
+    {"expect", speedups_expect, METH_VARARGS, expect_doc},
+    {"adjust", speedups_adjust, METH_VARARGS, adjust_doc},
+    {"replay", speedups_replay, METH_VARARGS, replay_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+
+#if PY_MAJOR_VERSION >= 3
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT, "_elospeedups", NULL, -1, speedups_methods,
+    NULL, NULL, NULL, NULL
+};
+
+PyMODINIT_FUNC
+PyInit__elospeedups(void)
+{
+    return PyModule_Create(&speedups_module);
+}
+#else
+PyMODINIT_FUNC
+init_elospeedups(void)
+{
+    Py_InitModule("_elospeedups", speedups_methods);
+}
+#endif
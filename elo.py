@@ -8,15 +8,38 @@
     :copyright: (c) 2012 by Heungsub Lee
     :license: BSD, see LICENSE for more details.
 """
-from datetime import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+import copy
+from datetime import datetime, timedelta
+import heapq
 import inspect
+import math
+import time
+from timeit import default_timer
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # for Python 3.6 and earlier
+    ContextVar = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import _elospeedups
+except ImportError:
+    _elospeedups = None
 
 
 __version__  = '0.1.1'
-__all__ = ['Elo', 'Rating', 'CountedRating', 'TimedRating', 'rate', 'adjust',
-           'expect', 'rate_1vs1', 'adjust_1vs1', 'quality_1vs1', 'setup',
-           'global_env', 'WIN', 'DRAW', 'LOSS', 'K_FACTOR', 'RATING_CLASS',
-           'INITIAL', 'BETA']
+__all__ = ['Elo', 'BaseRating', 'Rating', 'CountedRating', 'TimedRating',
+           'CompactRating', 'CompactCountedRating', 'CompactTimedRating',
+           'ExpectTable', 'ExponentialDecay', 'Instrument', 'Replay',
+           'IncrementalReplay', 'rate', 'adjust', 'expect', 'rate_1vs1',
+           'adjust_1vs1', 'quality_1vs1', 'setup', 'global_env', 'WIN',
+           'DRAW', 'LOSS', 'K_FACTOR', 'RATING_CLASS', 'INITIAL', 'BETA',
+           'EPOCH']
 
 
 #: The actual score for win.
@@ -34,21 +57,44 @@ RATING_CLASS = float
 INITIAL = 1200
 #: Default Beta value.
 BETA = 200
+#: The epoch of the timestamps in seconds of :meth:`Elo.decay_many`.
+EPOCH = datetime(1970, 1, 1)
 
 
-class Rating(object):
-
+def _init_params(f):
+    """Gets the names of the positional parameters of ``__init__``."""
     try:
-        __metaclass__ = __import__('abc').ABCMeta
-    except ImportError:
-        # for Python 2.5
-        pass
+        getargspec = inspect.getfullargspec
+    except AttributeError:
+        # for Python 2
+        getargspec = inspect.getargspec
+    try:
+        return tuple(getargspec(f)[0])
+    except TypeError:
+        # a slot wrapper such as object.__init__
+        return ()
 
-    value = None
+
+class BaseRating(object):
+    """The base of the rating classes. It doesn't have an instance
+    dictionary, so the compact rating classes which declare ``__slots__`` can
+    derive from it.
+    """
+
+    __slots__ = ()
+
+    #: The names of the extra fields such as ``times`` which :func:`repr`
+    #: shows. They are the parameters of ``__init__`` after the value, read
+    #: once when a subclass is created.
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super(BaseRating, cls).__init_subclass__(**kwargs)
+        cls._fields = _init_params(cls.__init__)[2:]
 
     def __init__(self, value=None):
         if value is None:
-            value = global_env().initial
+            value = _local_env.get(_global_env).initial
         self.value = value
 
     def rated(self, value):
@@ -58,6 +104,16 @@ class Rating(object):
         """
         return type(self)(value)
 
+    def update(self, value):
+        """Updates the rating in place to the recalculated rating. It is the
+        in-place version of :meth:`rated`.
+
+        :param value: the recalculated rating value.
+        :returns: the rating itself.
+        """
+        self.value = value
+        return self
+
     def __int__(self):
         """Type-casting to ``int``."""
         return int(self.value)
@@ -129,101 +185,894 @@ class Rating(object):
 
     def __repr__(self):
         c = type(self)
-        ext_params = inspect.getargspec(c.__init__)[0][2:]
-        kwargs = ', '.join('%s=%r' % (param, getattr(self, param))
-                           for param in ext_params)
+        try:
+            fields = c.__dict__['_fields']
+        except KeyError:
+            # for Python 2 which doesn't call __init_subclass__
+            fields = c._fields = _init_params(c.__init__)[2:]
+        kwargs = ', '.join('%s=%r' % (field, getattr(self, field))
+                           for field in fields)
         if kwargs:
             kwargs = ', ' + kwargs
         args = ('.'.join([c.__module__, c.__name__]), self.value, kwargs)
         return '%s(%.3f%s)' % args
 
 
+class Rating(BaseRating):
+
+    try:
+        __metaclass__ = __import__('abc').ABCMeta
+    except ImportError:
+        # for Python 2.5
+        pass
+
+    value = None
+
+
 try:
     Rating.register(float)
 except AttributeError:
     pass
 
 
-class CountedRating(Rating):
-    """Increases count each rating recalculation."""
+class _Counted(BaseRating):
 
-    times = None
+    __slots__ = ()
 
     def __init__(self, value=None, times=0):
         self.times = times
-        super(CountedRating, self).__init__(value)
+        super(_Counted, self).__init__(value)
 
     def rated(self, value):
-        rated = super(CountedRating, self).rated(value)
+        rated = super(_Counted, self).rated(value)
         rated.times = self.times + 1
         return rated
 
+    def update(self, value):
+        self.times += 1
+        return super(_Counted, self).update(value)
 
-class TimedRating(Rating):
-    """Writes the final rated time."""
 
-    rated_at = None
+class _Timed(BaseRating):
+
+    __slots__ = ()
+
+    #: The function which returns the current time for :attr:`rated_at`.
+    clock = staticmethod(datetime.utcnow)
 
     def __init__(self, value=None, rated_at=None):
         self.rated_at = rated_at
-        super(TimedRating, self).__init__(value)
+        super(_Timed, self).__init__(value)
 
     def rated(self, value):
-        rated = super(TimedRating, self).rated(value)
-        rated.rated_at = datetime.utcnow()
+        rated = super(_Timed, self).rated(value)
+        rated.rated_at = self.clock()
         return rated
 
+    def update(self, value):
+        self.rated_at = self.clock()
+        return super(_Timed, self).update(value)
+
+
+class CountedRating(_Counted, Rating):
+    """Increases count each rating recalculation."""
+
+    times = None
+
+
+class TimedRating(_Timed, Rating):
+    """Writes the final rated time."""
+
+    rated_at = None
+
+
+class CompactRating(BaseRating):
+    """A memory-compact :class:`Rating` which declares ``__slots__`` instead
+    of having an instance dictionary. Compact rating classes can't have
+    attributes out of their slots and can't be mixed by multiple inheritance.
+    """
+
+    __slots__ = ('value',)
+
+
+class CompactCountedRating(_Counted, CompactRating):
+    """A memory-compact :class:`CountedRating`."""
+
+    __slots__ = ('times',)
+
+
+class CompactTimedRating(_Timed, CompactRating):
+    """A memory-compact :class:`TimedRating`."""
+
+    __slots__ = ('rated_at',)
+
+
+class ExponentialDecay(object):
+    """A decay function for :attr:`Elo.decay` which pulls inactive ratings
+    toward the mean with a half-life. Without a grace period, decaying in
+    steps gives the same value as decaying at once.
+
+    >>> decay = ExponentialDecay(half_life=timedelta(days=30), mean=1200)
+    >>> decay(1600, timedelta(days=30).total_seconds())
+    1400.0
+
+    :param half_life: the time until the difference from the mean halves. A
+                      :class:`datetime.timedelta` or seconds.
+    :param mean: the rating which inactive ratings approach.
+    :param grace: the time without decay after a rating is rated.
+    """
+
+    def __init__(self, half_life, mean=INITIAL, grace=0):
+        if isinstance(half_life, timedelta):
+            half_life = half_life.total_seconds()
+        if isinstance(grace, timedelta):
+            grace = grace.total_seconds()
+        self.half_life = half_life
+        self.mean = mean
+        self.grace = grace
+
+    def __call__(self, value, seconds):
+        """Decays a rating value or a NumPy array of values by the seconds
+        since they were rated.
+        """
+        seconds = seconds - self.grace
+        if numpy is not None and isinstance(seconds, numpy.ndarray):
+            seconds = numpy.maximum(seconds, 0)
+        elif seconds <= 0:
+            return value
+        return self.mean + (value - self.mean) * \
+            0.5 ** (seconds / float(self.half_life))
+
+
+class ExpectTable(object):
+    """A precomputed table of the expected scores by quantized rating
+    differences. It is built by :meth:`Elo.cache_expect`.
+
+    A lookup replaces a power of 10 with an index and an interpolation, which
+    pays off in C: :meth:`Elo.adjust` over a long series is about 3 times
+    faster on the ``_elospeedups`` extension. A single :meth:`Elo.expect`
+    call is dominated by the call itself, and the pure Python lookup and the
+    NumPy lookup of :meth:`expect_many` are slower than the exact formula.
+    Run ``elobench.py expect_table`` to compare them.
+
+    :param beta: the Beta value of the environment.
+    :param bound: the largest absolute rating difference in the table. The
+                  exact formula is used for larger differences.
+    :param resolution: the rating difference between two table entries.
+    :param interpolate: interpolates linearly between two table entries
+                        instead of taking the nearest one.
+    """
+
+    def __init__(self, beta, bound=2000, resolution=1., interpolate=True):
+        self.beta = beta
+        self.bound = bound
+        self.resolution = resolution
+        self.interpolate = interpolate
+        size = int(math.ceil(2. * bound / resolution)) + 1
+        self.table = array('d', (self.exact(resolution * x - bound)
+                                 for x in range(size)))
+        # a list is indexed faster than an array
+        self._values = self.table.tolist()
+        self._scale = 1. / resolution
+        self._offset = bound * self._scale
+        self._last = size - 1
+        # the arguments of the table for _elospeedups
+        self._args = (self.table, self._scale, self._offset, int(interpolate))
+        #: The maximum absolute error against the exact formula.
+        self.max_error = self.measure_error()
+
+    def exact(self, diff):
+        """The expected score by the exact formula."""
+        return 1. / (1 + 10 ** (diff / (2 * self.beta)))
+
+    def expect(self, diff):
+        """The expected score of a rating which is lower than the other rating
+        by ``diff``.
+        """
+        pos = diff * self._scale + self._offset
+        if not 0 <= pos <= self._last:
+            return 1. / (1 + 10 ** (diff / (2 * self.beta)))
+        values = self._values
+        if not self.interpolate:
+            return values[int(pos + 0.5)]
+        x = int(pos)
+        if x == self._last:
+            x -= 1
+        lower = values[x]
+        return lower + (values[x + 1] - lower) * (pos - x)
+
+    def expect_many(self, diffs):
+        """Vectorized :meth:`expect` for a NumPy array of differences."""
+        table = numpy.frombuffer(self.table, dtype=float)
+        last = self._last
+        diffs = numpy.asarray(diffs, dtype=float)
+        pos = diffs * self._scale + self._offset
+        within = (pos >= 0) & (pos <= last)
+        all_within = within.all()
+        if not all_within:
+            pos[~within] = 0.
+        if self.interpolate:
+            x = pos.astype(numpy.intp)
+            numpy.minimum(x, last - 1, out=x)
+            lower = table[x]
+            expects = table[x + 1] - lower
+            expects *= pos - x
+            expects += lower
+        else:
+            pos += 0.5
+            expects = table[pos.astype(numpy.intp)]
+        if not all_within:
+            # only the differences out of the table are calculated exactly
+            out = ~within
+            expects[out] = 1. / (1 + 10 ** (diffs[out] / (2 * self.beta)))
+        return expects
+
+    def measure_error(self, samples=16):
+        """Measures the maximum absolute error against the exact formula at
+        ``samples`` evenly spaced differences between each pair of the table
+        entries.
+        """
+        max_error = 0.
+        step = float(self.resolution) / samples
+        for x in range((len(self.table) - 1) * samples + 1):
+            diff = step * x - self.bound
+            max_error = max(max_error, abs(self.expect(diff) - self.exact(diff)))
+        return max_error
+
+
+class Instrument(object):
+    """Collects the calls of the environments which are instrumented by
+    :meth:`Elo.instrument`: the call counts and the latency histograms by the
+    method names. A callable K-factor is counted as ``k_factor``.
+
+    >>> instrument = Elo(k_factor=25).instrument().instrumentation
+    >>> instrument.counts
+    {}
+
+    :param bounds: the upper bounds of the histogram buckets in seconds. The
+                   last bucket is unbounded.
+    :param callbacks: the functions which are called with the method name and
+                      the elapsed seconds of every call, to export the calls
+                      to a metrics system.
+    """
+
+    #: The default upper bounds of the histogram buckets in seconds.
+    bounds = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+
+    def __init__(self, bounds=None, callbacks=()):
+        if bounds is not None:
+            self.bounds = tuple(bounds)
+        self.callbacks = list(callbacks)
+        #: The call counts by the method names.
+        self.counts = {}
+        #: The histograms by the method names. A histogram is a list of the
+        #: call counts of the buckets.
+        self.histograms = {}
+
+    def record(self, name, elapsed):
+        """Records a call of the method."""
+        self.counts[name] = self.counts.get(name, 0) + 1
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = [0] * (len(self.bounds) + 1)
+        histogram[bisect_left(self.bounds, elapsed)] += 1
+        for callback in self.callbacks:
+            callback(name, elapsed)
+
+    def wrap(self, name, f):
+        """Makes a function which records the calls of the function."""
+        record = self.record
+
+        def instrumented(*args, **kwargs):
+            started_at = default_timer()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                record(name, default_timer() - started_at)
+        instrumented.__name__ = getattr(f, '__name__', name)
+        instrumented.__module__ = getattr(f, '__module__', None)
+        instrumented.__wrapped__ = f
+        return instrumented
+
+    def export(self):
+        """Exports the counts and the histograms as a dictionary which can be
+        serialized to JSON. The upper bound of the last bucket is ``None``.
+        """
+        bounds = list(self.bounds) + [None]
+        return dict((name, {'count': count,
+                            'histogram': list(zip(bounds,
+                                                  self.histograms[name]))})
+                    for name, count in self.counts.items())
+
 
 class Elo(object):
 
+    #: Whether :meth:`expect` and :meth:`adjust` run on the C implementations
+    #: of the ``_elospeedups`` extension. It is ``True`` if the extension is
+    #: built. The results are the same bit for bit as the pure Python
+    #: implementations. :meth:`adjust` doesn't use it with an overridden
+    #: :meth:`expect`.
+    speedups = _elospeedups is not None
+
+    #: The decay function of inactive ratings. It is called with a rating
+    #: value and the seconds since :attr:`TimedRating.rated_at` and returns
+    #: the decayed value, such as :class:`ExponentialDecay`. The decay is
+    #: applied lazily when a rating is read by :meth:`decayed` or rated by
+    #: :meth:`rate`, :meth:`rate_period`, :meth:`rate_ffa` or
+    #: :meth:`rate_1vs1_batch`, and the K-factor sees the decayed rating.
+    #: Ratings without ``rated_at`` don't decay. :class:`Replay` rejects it.
+    decay = None
+
+    #: The :class:`elohistory.RatingHistory` which records the ratings rated
+    #: with the player keys by :meth:`rate`, :meth:`rate_1vs1`,
+    #: :meth:`rate_period`, :meth:`rate_rounds` and :meth:`rate_stream`. It
+    #: is not pickled with the environment.
+    history = None
+
     def __init__(self, k_factor=K_FACTOR, rating_class=RATING_CLASS,
                  initial=INITIAL, beta=BETA):
         self.k_factor = k_factor
         self.rating_class = rating_class
         self.initial = initial
+        #: The :class:`ExpectTable` which :meth:`expect` looks up. See
+        #: :meth:`cache_expect`.
+        self.expect_table = None
         self.beta = beta
 
+    @property
+    def beta(self):
+        return self._beta
+
+    @beta.setter
+    def beta(self, beta):
+        self._beta = beta
+        table = self.expect_table
+        if table is not None:
+            self.cache_expect(table.bound, table.resolution, table.interpolate)
+
     def expect(self, rating, other_rating):
         """The "E" function in Elo. It calculates the expected score of the
         first rating by the second rating.
         """
         # http://www.chess-mind.com/en/elo-system
+        table = self.expect_table
+        if self.speedups:
+            if table is None:
+                return _elospeedups.expect(rating, other_rating,
+                                           2 * self.beta)
+            return _elospeedups.expect(rating, other_rating, 2 * self.beta,
+                                       *table._args)
         diff = float(other_rating) - float(rating)
+        if table is not None:
+            return table.expect(diff)
         f_factor = 2 * self.beta  # rating disparity
         return 1. / (1 + 10 ** (diff / f_factor))
 
+    def expect_many(self, diffs):
+        """Vectorized :meth:`expect` of the ratings which are lower than the
+        other ratings by ``diffs``. It looks up :attr:`expect_table` if it is
+        set. An overridden :meth:`expect` is called for each difference. It
+        requires NumPy.
+
+        The ``_elospeedups`` extension has no vectorized kernel, so the
+        expected scores are calculated by NumPy regardless of
+        :attr:`speedups`. NumPy may round them differently in the last bits.
+
+        :returns: a NumPy array of the same shape as ``diffs``.
+        """
+        diffs = numpy.asarray(diffs, dtype=float)
+        if type(self).expect is not Elo.expect:
+            expect = self.expect
+            return numpy.fromiter((expect(0., diff) for diff in diffs.flat),
+                                  float, diffs.size).reshape(diffs.shape)
+        table = self.expect_table
+        if table is not None:
+            return table.expect_many(diffs)
+        return 1. / (1 + 10 ** (diffs / (2 * self.beta)))
+
+    def cache_expect(self, bound=2000, resolution=1., interpolate=True):
+        """Makes :meth:`expect` look up a precomputed :class:`ExpectTable`
+        instead of calculating the exact formula. The table is rebuilt when
+        :attr:`beta` changes. Set :attr:`expect_table` to ``None`` to use the
+        exact formula again.
+
+        >>> env = Elo()
+        >>> table = env.cache_expect(resolution=0.5)
+        >>> table.max_error < 1e-7
+        True
+
+        :returns: the built table. Its :attr:`ExpectTable.max_error` is the
+                  maximum error against the exact formula.
+        """
+        self.expect_table = ExpectTable(self.beta, bound, resolution,
+                                        interpolate)
+        return self.expect_table
+
     def adjust(self, rating, series):
         """Calculates the adjustment value."""
+        if self.speedups and type(self).expect is Elo.expect and \
+                'expect' not in self.__dict__:
+            table = self.expect_table
+            if table is None:
+                return _elospeedups.adjust(rating, series, 2 * self.beta)
+            return _elospeedups.adjust(rating, series, 2 * self.beta,
+                                       *table._args)
         return sum(score - self.expect(rating, other_rating)
                    for score, other_rating in series)
 
-    def rate(self, rating, series):
-        """Calculates new ratings by the game result series."""
+    def rate(self, rating, series, inplace=False, key=None):
+        """Calculates new ratings by the game result series.
+
+        :param inplace: updates the rating object in place by
+                        :meth:`BaseRating.update` instead of creating a new
+                        one by :meth:`BaseRating.rated`. Immutable ratings such
+                        as ``float`` are not affected.
+        :param key: the key of the player. The new rating is recorded in
+                    :attr:`history` by it.
+        """
         rating = self.ensure_rating(rating)
-        k = self.k_factor(rating) if callable(self.k_factor) else self.k_factor
-        new_rating = float(rating) + k * self.adjust(rating, series)
-        if hasattr(rating, 'rated'):
+        if self.decay is None:
+            k = self._k_factor(rating)
+            new_rating = float(rating) + k * self.adjust(rating, series)
+        else:
+            decayed = self._decayed_rating(rating)
+            value = float(decayed)
+            series = [(score, self.decayed(other_rating))
+                      for score, other_rating in series]
+            new_rating = value + self._k_factor(decayed) * \
+                self.adjust(value, series)
+        if inplace and hasattr(rating, 'update'):
+            new_rating = rating.update(new_rating)
+        elif hasattr(rating, 'rated'):
             new_rating = rating.rated(new_rating)
+        if key is not None:
+            self._record(key, new_rating)
         return new_rating
 
+    def _record(self, key, rating):
+        if self.history is not None:
+            self.history.record(key, rating)
+
+    def decayed(self, rating, at=None):
+        """Reads the rating value decayed by :attr:`decay` at the time.
+
+        :param at: the time to read at. The clock of the rating class by
+                   default.
+        """
+        rated_at = getattr(rating, 'rated_at', None)
+        if self.decay is None or rated_at is None:
+            return float(rating)
+        if at is None:
+            at = rating.clock()
+        return self.decay(float(rating), (at - rated_at).total_seconds())
+
+    def _decayed_rating(self, rating):
+        """Makes a copy of the rating with the decayed value, so that a
+        K-factor sees the rating as an eager sweep would leave it.
+        """
+        if self.decay is None or getattr(rating, 'rated_at', None) is None:
+            return rating
+        decayed = copy.copy(rating)
+        decayed.value = self.decayed(rating)
+        return decayed
+
+    def decay_many(self, values, rated_at, at):
+        """Vectorized :meth:`decayed` for bulk exports. It requires NumPy.
+        The values are the same as :meth:`decayed` reads up to rounding.
+
+        :param values: the rating values.
+        :param rated_at: the rated times in seconds since :data:`EPOCH`. NaN
+                         means not rated yet.
+        :param at: the time to read at.
+        :returns: a NumPy array of the decayed values.
+        """
+        values = numpy.asarray(values, dtype=float)
+        if self.decay is None:
+            return values.copy()
+        rated_at = numpy.asarray(rated_at, dtype=float)
+        seconds = (at - EPOCH).total_seconds() - rated_at
+        rated = ~numpy.isnan(rated_at)
+        decayed = values.copy()
+        decayed[rated] = self.decay(values[rated], seconds[rated])
+        return decayed
+
     def adjust_1vs1(self, rating1, rating2, drawn=False):
         return self.adjust(rating1, [(DRAW if drawn else WIN, rating2)])
 
-    def rate_1vs1(self, rating1, rating2, drawn=False):
+    def rate_1vs1(self, rating1, rating2, drawn=False, keys=(None, None)):
         scores = (DRAW, DRAW) if drawn else (WIN, LOSS)
-        return (self.rate(rating1, [(scores[0], rating2)]),
-                self.rate(rating2, [(scores[1], rating1)]))
+        return (self.rate(rating1, [(scores[0], rating2)], key=keys[0]),
+                self.rate(rating2, [(scores[1], rating1)], key=keys[1]))
+
+    def rate_1vs1_batch(self, ratings1, ratings2, scores):
+        """Rates many independent 1 vs 1 games at once. Each game is rated
+        from the given ratings only, so the result of a game is the same as
+        :meth:`rate_1vs1` for the game. NumPy may round the expected scores
+        differently in the last bits, so the NumPy results may differ from
+        :meth:`rate_1vs1` by a few ULPs.
+
+        :param ratings1: the ratings of the first players.
+        :param ratings2: the ratings of the second players.
+        :param scores: the actual scores of the first players. One of
+                       :data:`WIN`, :data:`DRAW` and :data:`LOSS`.
+        :returns: a tuple of two sequences of the new rating values. These
+                  are NumPy arrays if any argument is a NumPy array, otherwise
+                  ``array('d')``.
+
+        A callable K-factor is evaluated for each rating. If the ratings are
+        given as rating objects (not as values), the K-factor sees their extra
+        data such as :attr:`CountedRating.times`. The rating objects are
+        decayed by :attr:`decay`.
+        """
+        if not len(ratings1) == len(ratings2) == len(scores):
+            raise ValueError('Ratings and scores must be the same length')
+        if self.decay is not None:
+            ratings1, ratings2 = [
+                ratings if numpy is not None and
+                isinstance(ratings, numpy.ndarray) else
+                [self._decayed_rating(rating) for rating in ratings]
+                for ratings in (ratings1, ratings2)]
+        if numpy is not None and any(isinstance(x, numpy.ndarray)
+                                     for x in (ratings1, ratings2, scores)):
+            return self._rate_1vs1_batch_numpy(ratings1, ratings2, scores)
+        values1, values2 = array('d'), array('d')
+        for rating1, rating2, score in zip(ratings1, ratings2, scores):
+            value1, value2 = float(rating1), float(rating2)
+            k1, k2 = self._k_factor(rating1), self._k_factor(rating2)
+            values1.append(value1 + k1 * (score - self.expect(value1, value2)))
+            values2.append(value2 + k2 * ((WIN - score) -
+                                          self.expect(value2, value1)))
+        return values1, values2
+
+    def _rate_1vs1_batch_numpy(self, ratings1, ratings2, scores):
+        values1 = numpy.asarray(ratings1, dtype=float)
+        values2 = numpy.asarray(ratings2, dtype=float)
+        scores = numpy.asarray(scores, dtype=float)
+        if callable(self.k_factor):
+            k1, k2 = [numpy.fromiter(map(self._k_factor, ratings.tolist()
+                                         if isinstance(ratings, numpy.ndarray)
+                                         else ratings),
+                                     dtype=float, count=len(values1))
+                      for ratings in (ratings1, ratings2)]
+        else:
+            k1 = k2 = self.k_factor
+        expects1 = self.expect_many(values2 - values1)
+        expects2 = self.expect_many(values1 - values2)
+        return (values1 + k1 * (scores - expects1),
+                values2 + k2 * ((WIN - scores) - expects2))
+
+    def rate_ffa(self, ratings, placements):
+        """Rates a free-for-all game. Every player beats the players in worse
+        places and draws with the players in the same place. The result is
+        the same as calling :meth:`rate` for each player with the series of
+        all the other players, but the actual scores are counted by sorted
+        placements in O(n log n) and the expected scores are summed in one
+        vectorized pass if NumPy is available.
+
+        >>> env = Elo(k_factor=10)
+        >>> [round(r, 3) for r in env.rate_ffa([1500, 1000, 2000], [1, 2, 3])]
+        [1510.0, 1009.436, 1980.564]
+
+        :param ratings: the ratings of the players.
+        :param placements: the places of the players. Lower is better.
+        :returns: a list of the new ratings.
+        """
+        ratings = [self.ensure_rating(rating) for rating in ratings]
+        if len(ratings) != len(placements):
+            raise ValueError('Ratings and placements must be the same length')
+        size = len(ratings)
+        decayed = [self._decayed_rating(rating) for rating in ratings]
+        values = [float(rating) for rating in decayed]
+        expects = self._sum_expects(values)
+        sorted_placements = sorted(placements)
+        new_ratings = []
+        for rating, value, placement, expect, decayed_rating in \
+                zip(ratings, values, placements, expects, decayed):
+            lower = bisect_left(sorted_placements, placement)
+            upper = bisect_right(sorted_placements, placement)
+            score = (size - upper) * WIN + (upper - lower - 1) * DRAW
+            new_rating = value + self._k_factor(decayed_rating) * \
+                (score - expect)
+            if hasattr(rating, 'rated'):
+                new_rating = rating.rated(new_rating)
+            new_ratings.append(new_rating)
+        return new_ratings
+
+    def _sum_expects(self, values):
+        """Sums the expected scores of each rating against the other
+        ratings.
+        """
+        if numpy is None:
+            return [sum(self.expect(value, other_value)
+                        for y, other_value in enumerate(values) if x != y)
+                    for x, value in enumerate(values)]
+        values = numpy.asarray(values, dtype=float)
+        diffs = values[numpy.newaxis, :] - values[:, numpy.newaxis]
+        expects = self.expect_many(diffs)
+        numpy.fill_diagonal(expects, 0)
+        return expects.sum(axis=1).tolist()
+
+    def rate_period(self, ratings, games):
+        """Rates the games of a rating period. Each player is rated once by
+        the rating before the period against every opponent in the period,
+        so the result is the same as calling :meth:`rate` for each player
+        with the series of the player's games. The K-factor is evaluated once
+        per player, the expected scores are calculated in one vectorized pass
+        if NumPy is available, and the new ratings are committed at the end.
+        NumPy may round the expected scores differently in the last bits.
+
+        :param ratings: a dictionary of the ratings by the player keys. The
+                        new ratings are written to it. Unknown players start
+                        with the initial rating.
+        :param games: an iterable of ``(key1, key2, score)`` tuples.
+                      ``score`` is the actual score of the first player.
+        :returns: ``ratings``.
+        """
+        player_ids, keys = {}, []
+        player_ids1, player_ids2, scores = array('l'), array('l'), array('d')
+        for key1, key2, score in games:
+            for key, ids in ((key1, player_ids1), (key2, player_ids2)):
+                try:
+                    ids.append(player_ids[key])
+                except KeyError:
+                    player_ids[key] = len(keys)
+                    ids.append(len(keys))
+                    keys.append(key)
+            scores.append(score)
+        before = []
+        for key in keys:
+            try:
+                before.append(self.ensure_rating(ratings[key]))
+            except KeyError:
+                before.append(self.create_rating())
+        decayed = [self._decayed_rating(rating) for rating in before]
+        values = array('d', map(float, decayed))
+        adjustments = self._adjust_period(values, player_ids1, player_ids2,
+                                          scores)
+        rated = []
+        for rating, decayed_rating, value, adjustment in \
+                zip(before, decayed, values, adjustments):
+            new_rating = value + self._k_factor(decayed_rating) * adjustment
+            if hasattr(rating, 'rated'):
+                new_rating = rating.rated(new_rating)
+            rated.append(new_rating)
+        ratings.update(zip(keys, rated))
+        if self.history is not None:
+            for key, new_rating in zip(keys, rated):
+                self.history.record(key, new_rating)
+        return ratings
+
+    def _adjust_period(self, values, player_ids1, player_ids2, scores):
+        """Sums the adjustments of each player in the order of the games."""
+        if numpy is None or self.expect_table is not None:
+            expect = self.expect
+            adjustments = [0] * len(values)
+            for player_id1, player_id2, score in \
+                    zip(player_ids1, player_ids2, scores):
+                value1, value2 = values[player_id1], values[player_id2]
+                adjustments[player_id1] += score - expect(value1, value2)
+                adjustments[player_id2] += \
+                    (WIN - score) - expect(value2, value1)
+            return adjustments
+        values = numpy.frombuffer(values, dtype=float)
+        # array('l') is 4 or 8 bytes by the platform. NumPy reads the size
+        # from the buffer format.
+        player_ids1 = numpy.asarray(player_ids1)
+        player_ids2 = numpy.asarray(player_ids2)
+        scores = numpy.frombuffer(scores, dtype=float)
+        values1, values2 = values[player_ids1], values[player_ids2]
+        expects1 = self.expect_many(values2 - values1)
+        expects2 = self.expect_many(values1 - values2)
+        # interleaves both sides of the games to sum in the order of games
+        player_ids = numpy.column_stack((player_ids1, player_ids2)).ravel()
+        weights = numpy.column_stack((scores - expects1,
+                                      (WIN - scores) - expects2)).ravel()
+        return numpy.bincount(player_ids, weights, len(values)).tolist()
+
+    def rate_rounds(self, ratings, rounds, pool=None, chunksize=1024):
+        """Rates the 1 vs 1 games of rounds such as Swiss-system rounds. Every
+        player plays at most once in a round, so the games in a round are
+        rated in parallel by the pool. The rounds are rated in order. The
+        result is the same as calling :meth:`rate_1vs1` for each game.
+
+        The K-factors and the decay are evaluated in the current thread, so a
+        task carries only the rating values, the K-factors, the scores and
+        the parameters of the expected score. The pool sees neither the
+        environment nor the rating objects. An environment which overrides
+        :meth:`expect` rates the games in the current thread. The work left
+        in the current thread bounds the speedup of a process pool, which
+        the ``rounds`` benchmark of :mod:`elobench` measures.
+
+        :param ratings: a dictionary of the ratings by the player keys. The
+                        new ratings are written to it. Unknown players start
+                        with the initial rating.
+        :param rounds: an iterable of the rounds. A round is a sequence of
+                       ``(key1, key2, score)`` tuples. ``score`` is the actual
+                       score of the first player.
+        :param pool: an object which has ``map(func, iterable)`` such as
+                     :class:`multiprocessing.pool.Pool` or
+                     :class:`concurrent.futures.Executor`. The games are rated
+                     in the current thread if it is not given.
+        :param chunksize: the number of games in a task for the pool.
+        :returns: ``ratings``.
+        """
+        if type(self).expect is not Elo.expect or 'expect' in self.__dict__:
+            pool = None
+        table = self.expect_table
+        params = (self.beta, None if table is None else
+                  (table.bound, table.resolution, table.interpolate),
+                  self.speedups)
+        for games in rounds:
+            keys = set()
+            for key1, key2, score in games:
+                if key1 in keys or key2 in keys or key1 == key2:
+                    raise ValueError('A player plays twice in a round')
+                keys.update((key1, key2))
+            rated = []
+            for key1, key2, score in games:
+                for key in (key1, key2):
+                    if key not in ratings:
+                        ratings[key] = self.create_rating()
+                rating1 = self.ensure_rating(ratings[key1])
+                rating2 = self.ensure_rating(ratings[key2])
+                decayed1 = self._decayed_rating(rating1)
+                decayed2 = self._decayed_rating(rating2)
+                rated.append((rating1, rating2, (
+                    float(decayed1), self._k_factor(decayed1),
+                    float(decayed2), self._k_factor(decayed2), score)))
+            tasks = [(params, [game[2] for game in rated[x:x + chunksize]])
+                     for x in range(0, len(rated), chunksize)]
+            if pool is None:
+                results = (_adjust_games(task, self) for task in tasks)
+            else:
+                results = pool.map(_adjust_games, tasks)
+            x = 0
+            for values in results:
+                for value1, value2 in values:
+                    key1, key2 = games[x][:2]
+                    rating1, rating2 = rated[x][:2]
+                    if hasattr(rating1, 'rated'):
+                        value1 = rating1.rated(value1)
+                    if hasattr(rating2, 'rated'):
+                        value2 = rating2.rated(value2)
+                    ratings[key1], ratings[key2] = value1, value2
+                    self._record(key1, value1)
+                    self._record(key2, value2)
+                    x += 1
+        return ratings
+
+    def rate_stream(self, ratings, events, batch_size=1, interval=None):
+        """Rates a stream of 1 vs 1 games lazily. The events are consumed only
+        as fast as the updates are consumed, and only the current batch is
+        kept in memory. See :func:`eloaio.rate_stream` for asyncio.
+
+        :param ratings: a dictionary of the ratings by the player keys. The
+                        new ratings are written to it. Unknown players start
+                        with the initial rating.
+        :param events: an iterable of ``(key1, key2, score)`` tuples. It may
+                       be an unbounded iterator.
+        :param batch_size: the maximum number of games in a batch.
+        :param interval: the maximum seconds to wait for a batch to fill. It
+                         is checked when a game arrives.
+        :returns: a generator of the batches. A batch is a list of
+                  ``(key, old_rating, new_rating)`` tuples.
+        """
+        batch, count, deadline = [], 0, None
+        for key1, key2, score in events:
+            batch.extend(self._rate_event(ratings, key1, key2, score))
+            count += 1
+            if interval is not None and deadline is None:
+                deadline = time.time() + interval
+            if count >= batch_size or \
+               deadline is not None and time.time() >= deadline:
+                yield batch
+                batch, count, deadline = [], 0, None
+        if batch:
+            yield batch
+
+    def _rate_event(self, ratings, key1, key2, score):
+        """Rates a game between the players in the dictionary and returns the
+        ``(key, old_rating, new_rating)`` tuples.
+        """
+        for key in (key1, key2):
+            if key not in ratings:
+                ratings[key] = self.create_rating()
+        rating1, rating2 = ratings[key1], ratings[key2]
+        new_rating1, new_rating2 = \
+            self._rate_1vs1_by_score(rating1, rating2, score, (key1, key2))
+        ratings[key1], ratings[key2] = new_rating1, new_rating2
+        return [(key1, rating1, new_rating1), (key2, rating2, new_rating2)]
+
+    def _rate_1vs1_by_score(self, rating1, rating2, score,
+                            keys=(None, None)):
+        return (self.rate(rating1, [(score, rating2)], key=keys[0]),
+                self.rate(rating2, [(WIN - score, rating1)], key=keys[1]))
+
+    def _k_factor(self, rating):
+        if not callable(self.k_factor):
+            return self.k_factor
+        return self.k_factor(self.ensure_rating(rating))
 
     def quality_1vs1(self, rating1, rating2):
         return 2 * (0.5 - abs(0.5 - self.expect(rating1, rating2)))
 
+    def max_diff_1vs1(self, quality):
+        """Calculates the largest rating difference between two players whose
+        :meth:`quality_1vs1` is at least the given quality.
+
+        >>> env = Elo()
+        >>> diff = env.max_diff_1vs1(0.5)
+        >>> round(env.quality_1vs1(1200, 1200 + diff), 6)
+        0.5
+        """
+        if quality <= 0:
+            return float('inf')
+        elif quality >= 1:
+            return 0.
+        return 2 * self.beta * math.log10(2. / quality - 1)
+
+    #: The names of the methods which :meth:`instrument` instruments.
+    instrumented_methods = ('expect', 'adjust', 'rate', 'adjust_1vs1',
+                            'rate_1vs1', 'quality_1vs1', 'rate_1vs1_batch',
+                            'rate_ffa')
+
+    #: The :class:`Instrument` of the environment if it is instrumented.
+    instrumentation = None
+
+    def instrument(self, instrumentation=None):
+        """Starts to record the calls of the methods and a callable K-factor
+        to an :class:`Instrument`. The methods are replaced on the instance
+        only, so the environments which are not instrumented don't pay any
+        cost.
+
+        :param instrumentation: the :class:`Instrument`. A new one by default.
+        :returns: the environment itself.
+        """
+        if instrumentation is None:
+            instrumentation = Instrument()
+        self.uninstrument()
+        self.instrumentation = instrumentation
+        for name in self.instrumented_methods:
+            method = getattr(self, name)
+            setattr(self, name, instrumentation.wrap(name, method))
+        if callable(self.k_factor):
+            self.k_factor = instrumentation.wrap('k_factor', self.k_factor)
+        return self
+
+    def uninstrument(self):
+        """Stops to record the calls and restores the methods."""
+        if self.instrumentation is None:
+            return
+        for name in self.instrumented_methods:
+            self.__dict__.pop(name, None)
+        if hasattr(self.k_factor, '__wrapped__'):
+            self.k_factor = self.k_factor.__wrapped__
+        del self.instrumentation
+
+    def __getstate__(self):
+        """Leaves the :attr:`history` and the instrumentation out, so that
+        the tasks of a process pool don't carry them. They stay with the
+        environment in the current process.
+        """
+        state = self.__dict__.copy()
+        state.pop('history', None)
+        if state.pop('instrumentation', None) is not None:
+            for name in self.instrumented_methods:
+                state.pop(name, None)
+            if hasattr(self.k_factor, '__wrapped__'):
+                state['k_factor'] = self.k_factor.__wrapped__
+        return state
+
     def create_rating(self, value=None, *args, **kwargs):
         if value is None:
             value = self.initial
         return self.rating_class(value, *args, **kwargs)
 
     def ensure_rating(self, rating):
-        if isinstance(rating, self.rating_class):
+        # checks the exact type first to skip the ABC instance check
+        if type(rating) is self.rating_class or \
+                isinstance(rating, self.rating_class):
             return rating
         return self.rating_class(rating)
 
@@ -242,12 +1091,36 @@ class Elo(object):
         """
         return setup(env=self)
 
+    def make_as_local(self):
+        """Registers the environment as the local environment of the current
+        context, such as an asyncio task or a thread. It takes precedence
+        over the global environment in the context. It requires
+        :mod:`contextvars` of Python 3.7 or later.
+
+        >>> env = Elo(initial=1500)
+        >>> with env.make_as_local():
+        ...     Rating()
+        elo.Rating(1500.000)
+        >>> Rating() == global_env().initial
+        True
+
+        :returns: a context manager which restores the previous local
+                  environment at the end of the block.
+        """
+        if ContextVar is None:
+            raise RuntimeError('Local environments require contextvars')
+        return _LocalEnvSetter(self)
+
     def __repr__(self):
         c = type(self)
         rc = self.rating_class
         if callable(self.k_factor):
             f = self.k_factor
-            k_factor = '.'.join([f.__module__, f.__name__])
+            try:
+                k_factor = '.'.join([f.__module__, f.__name__])
+            except AttributeError:
+                # a callable object such as elofit.PiecewiseK
+                k_factor = repr(f)
         else:
             k_factor = '%.3f' % self.k_factor
         args = ('.'.join([c.__module__, c.__name__]), k_factor,
@@ -256,43 +1129,326 @@ class Elo(object):
                 'initial=%.3f, beta=%.3f)' % args)
 
 
+class Replay(object):
+    """Replays a time-ordered match log on an environment. Players are
+    indexed by integer ids and their ratings are kept in compact arrays of
+    values, game counts and stable flags, which are updated in place. The
+    final ratings are the same as calling :meth:`Elo.rate_1vs1` for each game
+    in order. The games of a log have no times, so an environment with
+    :attr:`Elo.decay` can't be replayed.
+
+    >>> replay = Replay(Elo(k_factor=25))
+    >>> replay.run([('alice', 'bob', WIN), ('bob', 'carol', DRAW)])
+    >>> round(replay.value('alice'), 3)
+    1212.5
+    """
+
+    def __init__(self, env=None):
+        if env is None:
+            env = global_env()
+        if env.decay is not None:
+            raise ValueError('A match log without times can\'t be decayed')
+        self.env = env
+        #: The player ids by the player keys.
+        self.ids = {}
+        #: The player keys by the player ids.
+        self.keys = []
+        self.values = array('d')
+        self.times = array('l')
+        self.stable = array('b')
+        rating_class = env.rating_class
+        self._counted = hasattr(rating_class, 'times')
+        self._stable = hasattr(rating_class, 'stable')
+        if hasattr(rating_class, 'value'):
+            # a reused rating object to show the K-factor without allocations
+            self._view = rating_class.__new__(rating_class)
+        else:
+            self._view = None
+
+    def add(self, key, rating=None):
+        """Adds a player and returns the player id.
+
+        :param key: the hashable key of the player.
+        :param rating: the rating of the player. The initial rating of the
+                       environment by default.
+        """
+        if key in self.ids:
+            raise KeyError('Already added player: %r' % (key,))
+        if rating is None:
+            rating = self.env.create_rating()
+        player_id = len(self.keys)
+        self.ids[key] = player_id
+        self.keys.append(key)
+        self.values.append(float(rating))
+        self.times.append(getattr(rating, 'times', None) or 0)
+        self.stable.append(bool(getattr(rating, 'stable', False)))
+        return player_id
+
+    def player_id(self, key):
+        """Gets the id of the player. The player is added with the initial
+        rating if the key is unknown.
+        """
+        try:
+            return self.ids[key]
+        except KeyError:
+            return self.add(key)
+
+    def play(self, player_id1, player_id2, score):
+        """Rates a 1 vs 1 game between two player ids.
+
+        :param score: the actual score of the first player. One of
+                      :data:`WIN`, :data:`DRAW` and :data:`LOSS`.
+        """
+        expect, values = self.env.expect, self.values
+        value1, value2 = values[player_id1], values[player_id2]
+        k1, k2 = self._k_factor(player_id1), self._k_factor(player_id2)
+        self._commit(player_id1, value1 + k1 * (score - expect(value1, value2)))
+        self._commit(player_id2, value2 + k2 * ((WIN - score) -
+                                                expect(value2, value1)))
+
+    def run(self, log):
+        """Replays the match log.
+
+        :param log: an iterable of ``(key1, key2, score)`` tuples in time
+                    order. ``score`` is the actual score of the first player.
+        """
+        player_id = self.player_id
+        for key1, key2, score in log:
+            self.play(player_id(key1), player_id(key2), score)
+
+    def value(self, key):
+        """Gets the current rating value of the player."""
+        return self.values[self.ids[key]]
+
+    def rating(self, key):
+        """Creates a rating object of the environment's rating class for the
+        current rating of the player.
+        """
+        player_id = self.ids[key]
+        value = self.values[player_id]
+        if not hasattr(self.env.rating_class, 'value'):
+            return self.env.ensure_rating(value)
+        kwargs = {}
+        if self._counted:
+            kwargs['times'] = self.times[player_id]
+        if self._stable:
+            kwargs['stable'] = bool(self.stable[player_id])
+        return self.env.create_rating(value, **kwargs)
+
+    def ratings(self):
+        """Creates a dictionary of the players' rating objects by the keys."""
+        return dict((key, self.rating(key)) for key in self.keys)
+
+    def _k_factor(self, player_id):
+        view = self._view
+        if not callable(self.env.k_factor):
+            return self.env.k_factor
+        elif view is None:
+            return self.env._k_factor(self.values[player_id])
+        view.value = self.values[player_id]
+        if self._counted:
+            view.times = self.times[player_id]
+        if self._stable:
+            view.stable = bool(self.stable[player_id])
+        return self.env.k_factor(view)
+
+    def _commit(self, player_id, value):
+        self.values[player_id] = value
+        if not self._counted:
+            return
+        self.times[player_id] += 1
+        if self._stable and hasattr(self._view, '_should_stable'):
+            # follows :meth:`elopopulars.FIDERating.rated`
+            view = self._view
+            view.value, view.times = value, self.times[player_id]
+            self.stable[player_id] = view._should_stable()
+
+
+class IncrementalReplay(Replay):
+    """A :class:`Replay` which remembers the played games with the ratings
+    of the players before each game, so that a corrected or voided game is
+    rated again with only the later games of the players which it affects.
+    The result is the same as replaying the corrected log from the start.
+
+    >>> replay = IncrementalReplay(Elo(k_factor=25))
+    >>> replay.run([('alice', 'bob', WIN), ('bob', 'carol', DRAW)])
+    >>> replay.correct(0, LOSS)
+    >>> round(replay.value('alice'), 3)
+    1187.5
+    """
+
+    def __init__(self, env=None):
+        super(IncrementalReplay, self).__init__(env)
+        #: The player ids of the games.
+        self.player_ids1, self.player_ids2 = array('l'), array('l')
+        #: The scores of the games. ``None`` for voided games.
+        self.scores = []
+        # the ratings of the players before each game
+        self._before = [(array('d'), array('l'), array('b')),
+                        (array('d'), array('l'), array('b'))]
+        # the positions of the games of each player
+        self._positions = []
+
+    def add(self, key, rating=None):
+        player_id = super(IncrementalReplay, self).add(key, rating)
+        self._positions.append(array('l'))
+        return player_id
+
+    def play(self, player_id1, player_id2, score):
+        position = len(self.scores)
+        self.player_ids1.append(player_id1)
+        self.player_ids2.append(player_id2)
+        self.scores.append(score)
+        for player_id, before in zip((player_id1, player_id2), self._before):
+            for column, data in zip(before, (self.values, self.times,
+                                             self.stable)):
+                column.append(data[player_id])
+            self._positions[player_id].append(position)
+        super(IncrementalReplay, self).play(player_id1, player_id2, score)
+
+    def correct(self, position, score):
+        """Corrects the score of a played game and rates the affected games
+        again.
+
+        :param position: the 0-based position of the game in the log.
+        :param score: the corrected score of the first player.
+        """
+        self.scores[position] = score
+        self._rerate(position)
+
+    def void(self, position):
+        """Voids a played game and rates the affected games again."""
+        self.correct(position, None)
+
+    def _rerate(self, start):
+        affected = set()
+        positions = [start]
+        last = None
+        while positions:
+            position = heapq.heappop(positions)
+            if position == last:
+                continue
+            last = position
+            player_ids = (self.player_ids1[position],
+                          self.player_ids2[position])
+            for player_id, before in zip(player_ids, self._before):
+                columns = list(zip(before, (self.values, self.times,
+                                            self.stable)))
+                if player_id in affected:
+                    # the new rating before the game
+                    for column, data in columns:
+                        column[position] = data[player_id]
+                else:
+                    # not affected until the game
+                    for column, data in columns:
+                        data[player_id] = column[position]
+                    affected.add(player_id)
+                player_positions = self._positions[player_id]
+                x = bisect_right(player_positions, position)
+                if x < len(player_positions):
+                    heapq.heappush(positions, player_positions[x])
+            score = self.scores[position]
+            if score is not None:
+                Replay.play(self, player_ids[0], player_ids[1], score)
+
+
+#: The environments which :func:`_adjust_games` made by their parameters,
+#: so that a worker builds an expectation table only once.
+_adjust_envs = {}
+
+
+def _adjust_games(task, env=None):
+    """Rates a chunk of 1 vs 1 games for :meth:`Elo.rate_rounds`. A game is
+    a ``(value1, k1, value2, k2, score)`` tuple and the new values are
+    returned. The environment is made of the parameters of the task unless
+    it is given. It is a module-level function to be picklable.
+    """
+    params, games = task
+    if env is None:
+        try:
+            env = _adjust_envs[params]
+        except KeyError:
+            beta, table, speedups = params
+            env = Elo(beta=beta)
+            if table is not None:
+                env.cache_expect(*table)
+            env.speedups = speedups
+            _adjust_envs[params] = env
+    adjust = env.adjust
+    return [(value1 + k1 * adjust(value1, [(score, value2)]),
+             value2 + k2 * adjust(value2, [(WIN - score, value1)]))
+            for value1, k1, value2, k2, score in games]
+
+
 def rate(rating, series):
-    return global_env().rate(rating, series)
+    return _local_env.get(_global_env).rate(rating, series)
 
 
 def adjust(rating, series):
-    return global_env().adjust(rating, series)
+    return _local_env.get(_global_env).adjust(rating, series)
 
 
 def expect(rating, other_rating):
-    return global_env().expect(rating, other_rating)
+    return _local_env.get(_global_env).expect(rating, other_rating)
 
 
 def rate_1vs1(rating1, rating2, drawn=False):
-    return global_env().rate_1vs1(rating1, rating2, drawn)
+    return _local_env.get(_global_env).rate_1vs1(rating1, rating2, drawn)
 
 
 def adjust_1vs1(rating1, rating2, drawn=False):
-    return global_env().adjust_1vs1(rating1, rating2, drawn)
+    return _local_env.get(_global_env).adjust_1vs1(rating1, rating2, drawn)
 
 
 def quality_1vs1(rating1, rating2):
-    return global_env().quality_1vs1(rating1, rating2)
+    return _local_env.get(_global_env).quality_1vs1(rating1, rating2)
 
 
 def setup(k_factor=K_FACTOR, rating_class=RATING_CLASS,
           initial=INITIAL, beta=BETA, env=None):
+    global _global_env
     if env is None:
         env = Elo(k_factor, rating_class, initial, beta)
-    global_env.__elo__ = env
+    _global_env = env
     return env
 
 
 def global_env():
-    """Gets the global Elo environment."""
-    try:
-        global_env.__elo__
-    except AttributeError:
-        # setup the default environment
-        setup()
-    return global_env.__elo__
+    """Gets the global Elo environment. The local environment of the current
+    context is preferred. See :meth:`Elo.make_as_local`.
+    """
+    return _local_env.get(_global_env)
+
+
+class _NoContextVar(object):
+    """Stands in for the context variable when :mod:`contextvars` is not
+    available. It never has a value.
+    """
+
+    def get(self, default):
+        return default
+
+
+class _LocalEnvSetter(object):
+    """Restores the previous local environment at the end of a ``with``
+    block.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.token = _local_env.set(env)
+
+    def __enter__(self):
+        return self.env
+
+    def __exit__(self, *exc_info):
+        _local_env.reset(self.token)
+
+
+# the environment which the module-level functions use. it is looked up
+# directly instead of through :func:`global_env` to save a function call.
+_global_env = Elo()
+if ContextVar is None:
+    _local_env = _NoContextVar()
+else:
+    _local_env = ContextVar('elo_env')
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+    eloaio
+    ~~~~~~
+
+    asyncio support for Elo. It requires Python 3.7 or later.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+import asyncio
+import pickle
+import sqlite3
+
+from elo import global_env
+
+
+__all__ = ['rate_stream', 'RatingService', 'MemoryBackend', 'SQLiteBackend']
+
+
+#: The sentinel which a reader puts after the last event.
+_DONE = object()
+
+
+async def rate_stream(ratings, events, batch_size=1, interval=None,
+                      maxsize=1024, env=None):
+    """The asyncio version of :meth:`elo.Elo.rate_stream`. A reader task
+    reads ahead at most ``maxsize`` events from the async iterator, so the
+    source is paused while the batches are not consumed. A batch is yielded
+    when ``interval`` seconds pass even if no game arrives.
+
+    :param events: an async iterable of ``(key1, key2, score)`` tuples.
+    :param maxsize: the maximum number of events to read ahead. ``0`` means
+                    unbounded, which disables backpressure.
+    :param env: the environment. The global environment by default.
+    """
+    if env is None:
+        env = global_env()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize)
+
+    async def read():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception:
+            await queue.put(_DONE)
+            raise
+        await queue.put(_DONE)
+
+    reader = asyncio.ensure_future(read())
+    batch, count, deadline = [], 0, None
+    try:
+        while True:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(0, deadline - loop.time())
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield batch
+                batch, count, deadline = [], 0, None
+                continue
+            if event is _DONE:
+                break
+            batch.extend(env._rate_event(ratings, *event))
+            count += 1
+            if interval is not None and deadline is None:
+                deadline = loop.time() + interval
+            if count >= batch_size:
+                yield batch
+                batch, count, deadline = [], 0, None
+        if batch:
+            yield batch
+        # raises the error from the source
+        await reader
+    finally:
+        reader.cancel()
+
+
+class MemoryBackend(object):
+    """A storage backend for :class:`RatingService` which keeps the ratings in
+    a dictionary. A backend has two coroutine methods: ``read(keys)`` returns
+    a dictionary of the stored ratings of the keys, and ``write(ratings)``
+    stores a dictionary of ratings.
+    """
+
+    def __init__(self, ratings=None):
+        self.ratings = {} if ratings is None else ratings
+
+    async def read(self, keys):
+        ratings = self.ratings
+        return dict((key, ratings[key]) for key in keys if key in ratings)
+
+    async def write(self, ratings):
+        self.ratings.update(ratings)
+
+
+class SQLiteBackend(object):
+    """A storage backend for :class:`RatingService` on SQLite. The queries
+    run on a pool of connections in the default executor, so the event loop
+    is not blocked. The ratings are pickled.
+
+    :param path: the path of the database file.
+    :param pool_size: the number of the connections.
+    """
+
+    def __init__(self, path, pool_size=4):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = None
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS ratings '
+                               '(key PRIMARY KEY, rating BLOB)')
+        connection.close()
+
+    async def _run(self, f, *args):
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+            for x in range(self.pool_size):
+                self._pool.put_nowait(sqlite3.connect(
+                    self.path, check_same_thread=False))
+        connection = await self._pool.get()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, f, connection, *args)
+        finally:
+            self._pool.put_nowait(connection)
+
+    @staticmethod
+    def _read(connection, keys):
+        ratings = {}
+        keys = list(keys)
+        for x in range(0, len(keys), 500):
+            chunk = keys[x:x + 500]
+            query = 'SELECT key, rating FROM ratings WHERE key IN (%s)'
+            for key, rating in connection.execute(
+                    query % ', '.join('?' * len(chunk)), chunk):
+                ratings[key] = pickle.loads(rating)
+        return ratings
+
+    @staticmethod
+    def _write(connection, ratings):
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO ratings VALUES (?, ?)',
+                [(key, pickle.dumps(rating))
+                 for key, rating in ratings.items()])
+
+    async def read(self, keys):
+        return await self._run(self._read, keys)
+
+    async def write(self, ratings):
+        await self._run(self._write, ratings)
+
+    async def close(self):
+        """Closes the connections."""
+        if self._pool is not None:
+            while not self._pool.empty():
+                self._pool.get_nowait().close()
+
+
+class RatingService(object):
+    """Rates 1 vs 1 games requested by concurrent tasks on ratings in a
+    storage backend. The requests which arrive while a batch is in progress
+    are coalesced into the next batch, which reads the ratings of the batch
+    at once, rates the games in the order of the requests and writes the new
+    ratings at once. If a game fails to be rated, only its request fails and
+    the other games of the batch are written.
+
+    The writes are pipelined: the next batch is rated on the ratings which
+    are still being written while the writes are committed in order. A
+    request returns after its batch is written. If a write fails, the
+    batches which were pipelined after it before the failure fail as well
+    because they were rated on the unwritten ratings. The later batches are
+    rated on the stored ratings again.
+
+    :param backend: the storage backend. See :class:`MemoryBackend`.
+    :param env: the environment. The global environment by default.
+    :param max_batch: the maximum number of games in a batch.
+    """
+
+    def __init__(self, backend, env=None, max_batch=4096):
+        if env is None:
+            env = global_env()
+        self.backend = backend
+        self.env = env
+        self.max_batch = max_batch
+        self._pending = []
+        self._worker = None
+        self._commit = None
+        # the ratings which are not written yet, with their batch numbers
+        self._writing = {}
+        self._batches = 0
+
+    def rate_1vs1(self, key1, key2, drawn=False):
+        """Rates a game by :meth:`elo.Elo.rate_1vs1`. Unknown players start
+        with the initial rating. It must be called in a running event loop.
+
+        It returns a future instead of a coroutine, so the requests gathered
+        by :func:`asyncio.gather` don't need to be wrapped in tasks.
+
+        :returns: a future of the new ratings.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((key1, key2, drawn, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._work())
+        return future
+
+    async def get(self, key):
+        """Gets the latest rating of the player."""
+        try:
+            return self._writing[key][0]
+        except KeyError:
+            pass
+        ratings = await self.backend.read([key])
+        return ratings.get(key)
+
+    async def drain(self):
+        """Waits until all the requested games are written."""
+        while self._worker is not None and not self._worker.done():
+            await self._worker
+        if self._commit is not None:
+            await self._commit
+
+    async def _work(self):
+        # yields once to coalesce the requests of the current loop iteration
+        await asyncio.sleep(0)
+        while self._pending:
+            games = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            self._batches += 1
+            batch = self._batches
+            # a failed write has removed its ratings from writing, so a batch
+            # rated after the failure doesn't depend on it
+            previous = self._commit
+            if previous is not None and previous.done() and \
+                    previous.result() is not None:
+                previous = None
+            try:
+                results, changed = await self._rate(games, batch)
+            except Exception as exc:
+                for game in games:
+                    if not game[3].done():
+                        game[3].set_exception(exc)
+                continue
+            self._commit = asyncio.ensure_future(self._write(
+                previous, batch, games, results, changed))
+
+    async def _rate(self, games, batch):
+        writing = self._writing
+        keys = set()
+        for key1, key2, drawn, future in games:
+            keys.update((key1, key2))
+        ratings = dict((key, writing[key][0]) for key in keys
+                       if key in writing)
+        missing = keys.difference(ratings)
+        if missing:
+            # only this worker adds ratings in writing, so the missing ratings
+            # are not changed while reading
+            ratings.update(await self.backend.read(missing))
+            for key in missing:
+                if key not in ratings:
+                    ratings[key] = self.env.create_rating()
+        results, changed = [], {}
+        rate_1vs1 = self.env.rate_1vs1
+        for key1, key2, drawn, future in games:
+            try:
+                rated = rate_1vs1(ratings[key1], ratings[key2], drawn)
+            except Exception as exc:
+                # fails only the game. The other games are committed.
+                if not future.done():
+                    future.set_exception(exc)
+                results.append(None)
+                continue
+            ratings[key1], ratings[key2] = rated
+            changed[key1], changed[key2] = rated
+            results.append(rated)
+        for key, rating in changed.items():
+            writing[key] = (rating, batch)
+        return results, changed
+
+    async def _write(self, previous, batch, games, results, changed):
+        """Writes a batch after the previous batch. It returns the error
+        instead of raising it, so a failed write is not left unretrieved.
+        """
+        error = None
+        if previous is not None:
+            error = await previous
+        if error is None:
+            try:
+                await self.backend.write(changed)
+            except Exception as exc:
+                error = exc
+        writing = self._writing
+        for key in changed:
+            if key in writing and writing[key][1] == batch:
+                del writing[key]
+        # only the written ratings are recorded
+        record = None if self.env.history is None else self.env._record
+        for (key1, key2, drawn, future), rated in zip(games, results):
+            if rated is None:
+                # the game failed to be rated
+                continue
+            if error is not None:
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            if record is not None:
+                record(key1, rated[0])
+                record(key2, rated[1])
+            if not future.done():
+                future.set_result(rated)
+        return error
@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+"""
+    elobench
+    ~~~~~~~~
+
+    Benchmarks for Elo. Run it with the names of the benchmarks to run, or
+    without any names to run all of them::
+
+       $ python elobench.py micro replay --json=new.json
+
+    ``--scale=0.01`` scales the sizes of the benchmarks down for a quick run.
+    ``--json=PATH`` writes the results as JSON. Two JSON results can be
+    compared to find regressions::
+
+       $ python elobench.py --compare old.json new.json --threshold=0.1
+
+    The metrics in percent are compared by their differences in percentage
+    points against ``--points=5``.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import print_function
+import gc
+import json
+import random
+import sys
+import threading
+from timeit import default_timer
+try:
+    import tracemalloc
+except ImportError:
+    # for Python 2
+    tracemalloc = None
+
+import elo
+from elo import *
+from eloboard import Leaderboard
+from elopopulars import CompactFIDERating, FIDERating, fide30, uscf
+from eloregistry import Registry
+
+
+#: The benchmark functions by their names.
+benchmarks = {}
+#: The results of the benchmarks by the metric names. A result is a
+#: dictionary of the value and the unit.
+results = {}
+
+
+def benchmark(f):
+    """Registers a benchmark function."""
+    benchmarks[f.__name__.replace('bench_', '', 1)] = f
+    return f
+
+
+def report(name, value, unit):
+    """Records a result of a benchmark."""
+    results[name] = {'value': value, 'unit': unit}
+    print('%s: %.3f %s' % (name, value, unit))
+
+
+def lower_is_better(unit):
+    return not unit.endswith('/sec')
+
+
+def measure_memory(factory, count=100000):
+    """Measures the average bytes of an object made by ``factory``. The bytes
+    of the objects which the object refers to are included.
+    """
+    if tracemalloc is None:
+        obj = factory(0)
+        size = sys.getsizeof(obj) + sum(map(sys.getsizeof, [
+            getattr(obj, '__dict__', {})] +
+            list(getattr(obj, '__dict__', {}).values())))
+        return float(size)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objs = [factory(x) for x in range(count)]
+        size = tracemalloc.get_traced_memory()[0] - sys.getsizeof(objs)
+    finally:
+        tracemalloc.stop()
+    return float(size) / count
+
+
+def measure_time(f, *args):
+    """Measures the seconds to call the function once."""
+    started_at = default_timer()
+    f(*args)
+    return default_timer() - started_at
+
+
+def measure_latency(f, number, repeat=5):
+    """Measures the median microseconds per call of the function."""
+    times = []
+    for x in range(repeat):
+        started_at = default_timer()
+        for y in range(number):
+            f()
+        times.append((default_timer() - started_at) / number)
+    times.sort()
+    return times[len(times) // 2] * 1e6
+
+
+def micro(name, f, scale):
+    """Reports the latency and throughput of the function."""
+    usec = measure_latency(f, max(1, int(10000 * scale)))
+    report(name + ' latency', usec, 'usec')
+    report(name + ' throughput', 1e6 / usec, 'calls/sec')
+
+
+def make_log(size, players, seed=0):
+    """Makes a synthetic match log of ``(key1, key2, score)`` tuples."""
+    rand = random.Random(seed)
+    log = []
+    for x in range(size):
+        key1 = rand.randrange(players)
+        key2 = (key1 + rand.randrange(1, players)) % players
+        log.append((key1, key2, rand.choice([WIN, DRAW, LOSS])))
+    return log
+
+
+#: The environments for the microbenchmarks by their names.
+envs = [('float', Elo(25)), ('CountedRating', Elo(25, CountedRating)),
+        ('TimedRating', Elo(25, TimedRating)),
+        ('FIDERating', Elo(25, FIDERating)), ('fide30', fide30),
+        ('uscf', uscf)]
+
+
+@benchmark
+def bench_micro(scale=1):
+    """Measures the methods of the environments for every rating class."""
+    for env_name, env in envs:
+        r1, r2, r3 = [env.create_rating(v) for v in (1500, 1400, 1700)]
+        series = [(WIN, r2), (LOSS, r3), (DRAW, r2)]
+        for name, f in [
+                ('expect', lambda: env.expect(r1, r2)),
+                ('adjust', lambda: env.adjust(r1, series)),
+                ('rate', lambda: env.rate(r1, series)),
+                ('rate_1vs1', lambda: env.rate_1vs1(r1, r2)),
+                ('quality_1vs1', lambda: env.quality_1vs1(r1, r2))]:
+            micro('%s %s' % (env_name, name), f, scale)
+
+
+@benchmark
+def bench_expect_table(scale=1):
+    """Compares the expectation table with the exact formula."""
+    exact, cached = Elo(25), Elo(25)
+    cached.cache_expect()
+    rand = random.Random(0)
+    series = [(rand.choice([WIN, DRAW, LOSS]), rand.uniform(500, 2500))
+              for x in range(1000)]
+    for name, env in [('exact', exact), ('table', cached)]:
+        micro('%s expect' % name, lambda: env.expect(1500, 1400), scale)
+        micro('%s adjust 1000 games' % name,
+              lambda: env.adjust(1500, series), scale / 100.)
+    if elo.numpy is None:
+        return
+    diffs = elo.numpy.random.default_rng(0).uniform(-1500, 1500,
+                                                     max(1, int(10 ** 6 *
+                                                                scale)))
+    elapsed = measure_time(lambda: 1. / (1 + 10 ** (diffs / 400.)))
+    report('exact expect_many %d' % len(diffs), elapsed, 'sec')
+    elapsed = measure_time(cached.expect_table.expect_many, diffs)
+    report('table expect_many %d' % len(diffs), elapsed, 'sec')
+
+
+@benchmark
+def bench_global(scale=1):
+    """Measures the module-level functions on the global environment."""
+    setup(k_factor=25)
+    series = [(WIN, 1400), (LOSS, 1700), (DRAW, 1400)]
+    for name, f in [
+            ('expect', lambda: elo.expect(1500, 1400)),
+            ('adjust', lambda: elo.adjust(1500, series)),
+            ('rate', lambda: elo.rate(1500, series)),
+            ('rate_1vs1', lambda: elo.rate_1vs1(1500, 1400)),
+            ('adjust_1vs1', lambda: elo.adjust_1vs1(1500, 1400)),
+            ('quality_1vs1', lambda: elo.quality_1vs1(1500, 1400)),
+            ('Rating', lambda: Rating())]:
+        micro('global %s' % name, f, scale)
+    setup()
+
+
+@benchmark
+def bench_batch(scale=1):
+    """Measures the batch methods."""
+    env = Elo(25)
+    size = max(1, int(100000 * scale))
+    rand = random.Random(size)
+    ratings1 = [rand.gauss(1500, 300) for x in range(size)]
+    ratings2 = [rand.gauss(1500, 300) for x in range(size)]
+    scores = [rand.choice([WIN, DRAW, LOSS]) for x in range(size)]
+    elapsed = measure_time(env.rate_1vs1_batch, ratings1, ratings2, scores)
+    report('rate_1vs1_batch throughput', size / elapsed, 'games/sec')
+    ratings = ratings1[:100]
+    placements = list(range(len(ratings)))
+    micro('rate_ffa 100 players', lambda: env.rate_ffa(ratings, placements),
+          scale / 100)
+
+
+@benchmark
+def bench_replay(scale=1):
+    """Replays a synthetic log of 1M games end-to-end."""
+    log = make_log(max(1, int(10 ** 6 * scale)), 10000)
+    for env_name, env in [('float', Elo(25)), ('fide30', fide30)]:
+        def rate_1vs1():
+            ratings = {}
+            for key1, key2, score in log:
+                for key in (key1, key2):
+                    if key not in ratings:
+                        ratings[key] = env.create_rating()
+                if score == LOSS:
+                    ratings[key2], ratings[key1] = \
+                        env.rate_1vs1(ratings[key2], ratings[key1])
+                else:
+                    ratings[key1], ratings[key2] = env.rate_1vs1(
+                        ratings[key1], ratings[key2], score == DRAW)
+        for name, f in [('rate_1vs1', rate_1vs1),
+                        ('Replay', lambda: Replay(env).run(log))]:
+            elapsed = measure_time(f)
+            report('%s replay by %s' % (env_name, name), elapsed, 'sec')
+            report('%s replay by %s throughput' % (env_name, name),
+                   len(log) / elapsed, 'games/sec')
+
+
+@benchmark
+def bench_memory(scale=1):
+    """Compares the memory of the rating classes and their compact
+    variants.
+    """
+    pairs = [(Rating, CompactRating), (CountedRating, CompactCountedRating),
+             (TimedRating, CompactTimedRating),
+             (FIDERating, CompactFIDERating)]
+    count = max(1, int(100000 * scale))
+    for classes in pairs:
+        for c in classes:
+            size = measure_memory(lambda x: c(1200. + x), count)
+            report('%s memory' % c.__name__, size, 'bytes')
+
+
+@benchmark
+def bench_rating(scale=1):
+    """Measures the construction, repr and :meth:`elo.Elo.ensure_rating` of
+    the rating classes.
+    """
+    for c in [Rating, CountedRating, TimedRating, FIDERating, CompactRating,
+              CompactFIDERating]:
+        env = Elo(25, c)
+        rating = c(1500.)
+        micro('%s construction' % c.__name__, lambda: c(1500.), scale)
+        micro('%s repr' % c.__name__, lambda: repr(rating), scale)
+        micro('%s ensure_rating' % c.__name__,
+              lambda: env.ensure_rating(rating), scale)
+        micro('%s ensure_rating float' % c.__name__,
+              lambda: env.ensure_rating(1500.), scale)
+
+
+@benchmark
+def bench_leaderboard(scale=1):
+    """Measures the leaderboard on 1M and 10M players."""
+    for size in [int(10 ** 6 * scale), int(10 ** 7 * scale)]:
+        rand = random.Random(size)
+        board = Leaderboard(Elo(25))
+        elapsed = measure_time(lambda: [board.__setitem__(x, rand.gauss(
+            1500, 300)) for x in range(size)])
+        report('leaderboard %d build' % size, elapsed, 'sec')
+        keys = [rand.randrange(size) for x in range(10000)]
+        for name, f in [('rate_1vs1',
+                         lambda x: board.rate_1vs1(x, (x + 1) % size)),
+                        ('rank', board.rank), ('percentile', board.percentile),
+                        ('count', lambda x: board.count(x % 3000, 3000)),
+                        ('top 100', lambda x: board.top(100))]:
+            elapsed = measure_time(lambda: [f(key) for key in keys])
+            report('leaderboard %d %s latency' % (size, name),
+                   elapsed / len(keys) * 1e6, 'usec')
+
+
+@benchmark
+def bench_instrument(scale=1):
+    """Verifies that disabled instrumentation costs nothing."""
+    series = [(WIN, 1400), (LOSS, 1700), (DRAW, 1400)]
+    plain = Elo(fide30.k_factor, FIDERating)
+    disabled = Elo(fide30.k_factor, FIDERating).instrument()
+    disabled.uninstrument()
+    enabled = Elo(fide30.k_factor, FIDERating).instrument()
+    rating = plain.create_rating(1500)
+    envs = [('plain', plain), ('disabled', disabled), ('enabled', enabled)]
+    # interleaves the measurements to cancel out the noise
+    usecs = [min(usecs) for usecs in zip(*[[
+        measure_latency(lambda: env.rate(rating, series),
+                        max(1, int(10000 * scale)))
+        for name, env in envs] for x in range(3)])]
+    for (name, env), usec in zip(envs, usecs):
+        report('instrument %s rate latency' % name, usec, 'usec')
+    for name, usec in [('disabled', usecs[1]), ('enabled', usecs[2])]:
+        report('instrument %s overhead' % name,
+               (usec / usecs[0] - 1) * 100, '%')
+
+
+@benchmark
+def bench_registry(scale=1):
+    """Measures the thread-safe registry on 8 threads."""
+    log = make_log(max(1, int(10 ** 5 * scale)), 1000)
+    for name in ['rate_1vs1', 'rate_1vs1_optimistic']:
+        registry = Registry(Elo(25))
+        rate_1vs1 = getattr(registry, name)
+        threads = [threading.Thread(target=lambda games: [
+            rate_1vs1(key1, key2, score == DRAW) for key1, key2, score in games
+        ], args=(log[x::8],)) for x in range(8)]
+
+        def run():
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        report('registry %s throughput' % name, len(log) / measure_time(run),
+               'games/sec')
+
+
+@benchmark
+def bench_service(scale=1):
+    """Measures the asyncio rating service on an in-memory backend."""
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+    from eloaio import MemoryBackend, RatingService
+    log = make_log(max(1, int(10 ** 5 * scale)), 10000)
+
+    async def run():
+        service = RatingService(MemoryBackend(), Elo(25))
+        for x in range(0, len(log), 10000):
+            await asyncio.gather(*[
+                service.rate_1vs1(key1, key2, score == DRAW)
+                for key1, key2, score in log[x:x + 10000]])
+        await service.drain()
+    elapsed = measure_time(asyncio.run, run())
+    report('service throughput', len(log) / elapsed, 'games/sec')
+
+
+@benchmark
+def bench_rounds(scale=1):
+    """Measures the scaling of rate_rounds over process pools."""
+    import multiprocessing
+    players = max(2, int(20000 * scale)) // 2 * 2
+    rand = random.Random(players)
+    keys = list(range(players))
+    rounds = []
+    for x in range(10):
+        rand.shuffle(keys)
+        scores = [rand.choice([WIN, DRAW, LOSS]) for y in range(players // 2)]
+        rounds.append(list(zip(keys[::2], keys[1::2], scores)))
+    size = len(rounds) * (players // 2)
+    env = fide30
+    elapsed = measure_time(env.rate_rounds, {}, rounds)
+    report('rate_rounds throughput', size / elapsed, 'games/sec')
+    for processes in [1, 2, 4]:
+        pool = multiprocessing.Pool(processes)
+        try:
+            elapsed = measure_time(env.rate_rounds, {}, rounds, pool)
+        finally:
+            pool.close()
+        report('rate_rounds %d processes throughput' % processes,
+               size / elapsed, 'games/sec')
+
+
+@benchmark
+def bench_speedups(scale=1):
+    """Measures the pure Python and C implementations of the kernels."""
+    if elo._elospeedups is None:
+        print('the _elospeedups extension is not built')
+        return
+    env = Elo(25)
+    series = [(WIN, 1400), (LOSS, 1700), (DRAW, 1400)] * 4
+    for name, f in [('expect', lambda: env.expect(1500, 1400)),
+                    ('adjust', lambda: env.adjust(1500, series)),
+                    ('rate', lambda: env.rate(1500, series))]:
+        for speedups in [False, True]:
+            env.speedups = speedups
+            micro('%s %s' % ('C' if speedups else 'Python', name), f, scale)
+
+
+@benchmark
+def bench_simulate(scale=1):
+    """Measures the Monte Carlo simulations of 256 players."""
+    if elo.numpy is None:
+        print('NumPy is not installed')
+        return
+    from elosim import simulate_bracket, simulate_swiss
+    rand = random.Random(256)
+    ratings = [rand.gauss(1500, 300) for x in range(256)]
+    replicas = max(1, int(100000 * scale))
+    elapsed = measure_time(simulate_bracket, ratings, replicas, Elo(25))
+    report('simulate_bracket 256 players', elapsed, 'sec')
+    report('simulate_bracket 256 players throughput', replicas / elapsed,
+           'replicas/sec')
+    # the K-factor of uscf, vectorized
+    from elofit import PiecewiseK
+    env = Elo(PiecewiseK([32, 24, 16], [2100, 2400]), initial=1300)
+    elapsed = measure_time(simulate_bracket, ratings, replicas, env)
+    report('simulate_bracket 256 players piecewise K', elapsed, 'sec')
+    replicas = max(1, int(10000 * scale))
+    elapsed = measure_time(simulate_swiss, ratings, 9, replicas, Elo(25))
+    report('simulate_swiss 256 players 9 rounds', elapsed, 'sec')
+
+
+@benchmark
+def bench_fit(scale=1):
+    """Measures fitting the parameters to 10M games."""
+    if elo.numpy is None:
+        print('NumPy is not installed')
+        return
+    import multiprocessing
+    import shutil
+    import tempfile
+    from elofit import MatchLog, fit, grid
+    numpy = elo.numpy
+    size, players = max(1, int(10 ** 7 * scale)), 100000
+    rng = numpy.random.default_rng(size)
+    player_ids1 = rng.integers(players, size=size)
+    player_ids2 = (player_ids1 + rng.integers(1, players, size=size)) % players
+    scores = rng.choice([WIN, DRAW, LOSS], size=size)
+    path = tempfile.mkdtemp()
+    try:
+        MatchLog(player_ids1, player_ids2, scores).save(path)
+        log = MatchLog.load(path)
+        candidates = grid(k_factor=[10, 20, 30, 40, 50], beta=[100, 150, 200],
+                          initial=[1200, 1500])
+        elapsed = measure_time(fit, log, candidates[:1])
+        report('fit throughput', size / elapsed, 'games/sec')
+        pool = multiprocessing.Pool()
+        try:
+            elapsed = measure_time(fit, log, candidates, 0.2, pool)
+        finally:
+            pool.close()
+        report('fit %d candidates' % len(candidates), elapsed, 'sec')
+    finally:
+        shutil.rmtree(path)
+
+
+@benchmark
+def bench_matrix(scale=1):
+    """Measures the pairwise matrices of 20k players."""
+    if elo.numpy is None:
+        print('NumPy is not installed')
+        return
+    import os
+    import tempfile
+    from elomatrix import expect_matrix, quality_pairs
+    rand = random.Random(20000)
+    ratings = [rand.gauss(1500, 300) for x in range(max(2, int(20000 *
+                                                               scale)))]
+    path = os.path.join(tempfile.mkdtemp(), 'expects.npy')
+    try:
+        elapsed = measure_time(expect_matrix, ratings, None, path,
+                               elo.numpy.float32)
+        report('expect_matrix %d players to file' % len(ratings), elapsed,
+               'sec')
+    finally:
+        os.remove(path)
+    elapsed = measure_time(quality_pairs, ratings, 0.99)
+    report('quality_pairs %d players' % len(ratings), elapsed, 'sec')
+
+
+@benchmark
+def bench_history(scale=1):
+    """Measures the storage size and the query latency of the rating history
+    of 1K players who have 1K entries each.
+    """
+    from datetime import datetime, timedelta
+    from elohistory import RatingHistory
+    players = max(1, int(1000 * scale))
+    entries = 1000
+    rand = random.Random(0)
+    history = RatingHistory()
+    start = datetime(2012, 1, 1)
+    for key in range(players):
+        value = 1500.
+        for x in range(entries):
+            value += rand.uniform(-16, 16)
+            history.record(key, value, start + timedelta(hours=x))
+    report('history bytes per entry',
+           history.nbytes / float(players * entries), 'bytes')
+    end = start + timedelta(hours=entries)
+    micro('history at', lambda: history.at(
+        rand.randrange(players), start + (end - start) * rand.random()),
+        scale)
+    micro('history range', lambda: history.range(
+        rand.randrange(players), start + timedelta(hours=500),
+        start + timedelta(hours=510)), scale)
+
+
+@benchmark
+def bench_decay(scale=1):
+    """Measures the lazy and the bulk decay of 5M ratings."""
+    from datetime import datetime, timedelta
+    env = Elo(25, TimedRating)
+    env.decay = ExponentialDecay(timedelta(days=30))
+    now = datetime(2012, 6, 1)
+    rating = TimedRating(1600, now - timedelta(days=40))
+    micro('decayed', lambda: env.decayed(rating, now), scale)
+    if elo.numpy is None:
+        return
+    size = max(1, int(5 * 10 ** 6 * scale))
+    rng = elo.numpy.random.default_rng(size)
+    values = rng.normal(1500, 300, size)
+    rated_at = (now - EPOCH).total_seconds() - rng.uniform(0, 1e7, size)
+    elapsed = measure_time(env.decay_many, values, rated_at, now)
+    report('decay_many %d ratings' % size, elapsed, 'sec')
+
+
+def compare(old_results, new_results, threshold=0.1, points=5.):
+    """Compares two results and returns the names of the regressed metrics.
+    A metric regresses if it gets worse by more than the threshold ratio. A
+    metric in percent, such as an overhead, regresses if it gets worse by
+    more than ``points`` percentage points instead, because the ratio of two
+    small percentages is mostly noise.
+    """
+    regressions = []
+    for name in sorted(set(old_results) & set(new_results)):
+        old, new = old_results[name]['value'], new_results[name]['value']
+        unit = new_results[name]['unit']
+        if unit == '%':
+            change = new - old
+            regressed = change > points
+            change_repr = '%+.1f points' % change
+        else:
+            if not old:
+                continue
+            change = (new - old) / float(old)
+            if not lower_is_better(unit):
+                change = -change
+            regressed = change > threshold
+            change_repr = '%+.1f%%' % (change * 100)
+        if regressed:
+            regressions.append(name)
+        print('%s%s: %.3f -> %.3f %s (%s)' % (
+            'REGRESSION ' if regressed else '', name, old, new, unit,
+            change_repr))
+    return regressions
+
+
+def main(args):
+    scale, threshold, points = 1, 0.1, 5.
+    json_path = None
+    names = []
+    for arg in args:
+        if arg.startswith('--scale='):
+            scale = float(arg.split('=', 1)[1])
+        elif arg.startswith('--json='):
+            json_path = arg.split('=', 1)[1]
+        elif arg.startswith('--threshold='):
+            threshold = float(arg.split('=', 1)[1])
+        elif arg.startswith('--points='):
+            points = float(arg.split('=', 1)[1])
+        else:
+            names.append(arg)
+    if '--compare' in names:
+        old_path, new_path = [name for name in names if name != '--compare']
+        with open(old_path) as f:
+            old_results = json.load(f)
+        with open(new_path) as f:
+            new_results = json.load(f)
+        return 1 if compare(old_results, new_results, threshold,
+                            points) else 0
+    for name in names or sorted(benchmarks):
+        print('[%s]' % name)
+        benchmarks[name](scale)
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+    eloboard
+    ~~~~~~~~
+
+    A leaderboard which ranks players' ratings in logarithmic time.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from array import array
+import math
+
+from elo import global_env
+
+
+__all__ = ['Leaderboard']
+
+
+class Leaderboard(object):
+    """A dictionary of ratings by player keys which indexes the ratings in a
+    Fenwick tree over rating buckets. Setting a rating updates the index, so
+    it can be passed to :meth:`elo.Elo.rate_rounds` or
+    :meth:`elo.Elo.rate_stream` as the ratings.
+
+    Ratings in a bucket are tied for ranks and ranges. Ratings out of
+    ``lower`` and ``upper`` fall into the first or last bucket.
+
+    >>> board = Leaderboard()
+    >>> board['alice'], board['bob'] = 1210, 1200
+    >>> board.rate_1vs1('bob', 'alice')
+    >>> board.rank('bob'), board.rank('alice')
+    (1, 2)
+
+    :param env: the environment. The global environment by default.
+    :param lower: the lowest rating of the buckets.
+    :param upper: the highest rating of the buckets.
+    :param resolution: the rating width of a bucket.
+    """
+
+    def __init__(self, env=None, lower=0, upper=4000, resolution=1.):
+        if env is None:
+            env = global_env()
+        self.env = env
+        self.lower = lower
+        self.resolution = resolution
+        self.size = int(math.ceil((upper - lower) / float(resolution))) + 1
+        self.tree = array('l', [0]) * (self.size + 1)
+        self.ratings = {}
+        self._buckets = {}
+
+    def bucket(self, rating):
+        """Gets the bucket index of the rating."""
+        x = int((float(rating) - self.lower) / self.resolution)
+        return min(max(x, 0), self.size - 1)
+
+    def _add(self, bucket, delta):
+        x = bucket + 1
+        while x <= self.size:
+            self.tree[x] += delta
+            x += x & -x
+
+    def _count_to(self, bucket):
+        """Counts the players in the buckets up to the bucket inclusive."""
+        x, count = bucket + 1, 0
+        while x > 0:
+            count += self.tree[x]
+            x -= x & -x
+        return count
+
+    def _search(self, count):
+        """Finds the lowest bucket which the ``count``-th lowest player is
+        in.
+        """
+        x, step = 0, 1 << self.size.bit_length()
+        while step:
+            if x + step <= self.size and self.tree[x + step] < count:
+                x += step
+                count -= self.tree[x]
+            step >>= 1
+        return x
+
+    def __setitem__(self, key, rating):
+        if key in self.ratings:
+            del self[key]
+        bucket = self.bucket(rating)
+        self.ratings[key] = rating
+        self._buckets.setdefault(bucket, set()).add(key)
+        self._add(bucket, 1)
+
+    def __delitem__(self, key):
+        bucket = self.bucket(self.ratings.pop(key))
+        keys = self._buckets[bucket]
+        keys.discard(key)
+        if not keys:
+            del self._buckets[bucket]
+        self._add(bucket, -1)
+
+    def __getitem__(self, key):
+        return self.ratings[key]
+
+    def __contains__(self, key):
+        return key in self.ratings
+
+    def __iter__(self):
+        return iter(self.ratings)
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def get(self, key, default=None):
+        return self.ratings.get(key, default)
+
+    def rate(self, key, series):
+        """Rates the player by :meth:`elo.Elo.rate` and updates the index.
+
+        :param series: a sequence of ``(score, other_key)`` tuples.
+        """
+        series = [(score, self.ratings[other]) for score, other in series]
+        self[key] = self.env.rate(self.ratings[key], series, key=key)
+
+    def rate_1vs1(self, key1, key2, drawn=False):
+        """Rates the players by :meth:`elo.Elo.rate_1vs1` and updates the
+        index.
+        """
+        self[key1], self[key2] = \
+            self.env.rate_1vs1(self.ratings[key1], self.ratings[key2], drawn,
+                               (key1, key2))
+
+    def rank(self, key):
+        """Gets the 1-based rank of the player. Tied players have the same
+        rank.
+        """
+        return len(self) - self._count_to(self.bucket(self.ratings[key])) + 1
+
+    def percentile(self, key):
+        """Gets the percentage of the players below the player."""
+        bucket = self.bucket(self.ratings[key])
+        return 100. * self._count_to(bucket - 1) / len(self)
+
+    def count(self, low, high):
+        """Counts the players whose ratings are between ``low`` and ``high``
+        inclusive.
+        """
+        low, high = self.bucket(low), self.bucket(high)
+        if low > high:
+            return 0
+        return self._count_to(high) - self._count_to(low - 1)
+
+    def top(self, k):
+        """Gets the ``(key, rating)`` tuples of the top ``k`` players in
+        descending order.
+        """
+        top = []
+        while len(top) < min(k, len(self)):
+            bucket = self._search(len(self) - len(top))
+            keys = self._buckets[bucket]
+            top.extend(sorted(((key, self.ratings[key]) for key in keys),
+                              key=lambda item: float(item[1]), reverse=True))
+        return top[:k]
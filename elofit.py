@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+    elofit
+    ~~~~~~
+
+    Fitting the parameters of Elo to a match history. It requires NumPy.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from bisect import bisect_right
+import itertools
+import math
+import os
+import pickle
+import random
+
+import numpy
+
+from elo import BETA, INITIAL, K_FACTOR, _elospeedups
+
+
+__all__ = ['PiecewiseK', 'MatchLog', 'grid', 'sample', 'evaluate', 'fit']
+
+
+class PiecewiseK(object):
+    """A K-factor by rating ranges like :data:`elopopulars.uscf`, with an
+    optional K-factor for provisional players like :data:`elopopulars.fide30`.
+    It is picklable and can be the K-factor of an environment. The
+    provisional K-factor requires a counted rating class.
+
+    >>> uscf_k = PiecewiseK([32, 24, 16], [2100, 2400])
+    >>> uscf_k(2000), uscf_k(2100), uscf_k(2500)
+    (32, 24, 16)
+
+    :param k_factors: the K-factors of the ranges. One more than the bounds.
+    :param bounds: the lowest ratings of the ranges except the first range.
+    :param provisional_k: the K-factor for the players who have played less
+                          than ``provisional_games`` games.
+    """
+
+    def __init__(self, k_factors, bounds=(), provisional_k=None,
+                 provisional_games=30):
+        if len(k_factors) != len(bounds) + 1:
+            raise ValueError('K-factors must be one more than the bounds')
+        self.k_factors = tuple(k_factors)
+        self.bounds = tuple(bounds)
+        self.provisional_k = provisional_k
+        self.provisional_games = provisional_games
+
+    def __call__(self, rating):
+        if self.provisional_k is not None and \
+                rating.times < self.provisional_games:
+            return self.provisional_k
+        return self.k_factors[bisect_right(self.bounds, float(rating))]
+
+    def many(self, values, times):
+        """Vectorized :meth:`__call__` for NumPy arrays of the rating values
+        and the game counts.
+        """
+        k_factors = numpy.asarray(self.k_factors, dtype=float)[
+            numpy.searchsorted(self.bounds, values, 'right')]
+        if self.provisional_k is not None:
+            k_factors = numpy.where(times < self.provisional_games,
+                                    float(self.provisional_k), k_factors)
+        return k_factors
+
+    def __repr__(self):
+        args = [repr(list(self.k_factors)), repr(list(self.bounds))]
+        if self.provisional_k is not None:
+            args.extend(['provisional_k=%r' % (self.provisional_k,),
+                         'provisional_games=%r' % (self.provisional_games,)])
+        return '%s(%s)' % (type(self).__name__, ', '.join(args))
+
+
+class MatchLog(object):
+    """A time-ordered match log encoded in compact arrays of player ids and
+    scores. A saved log is loaded by memory mapping, so the processes which
+    evaluate candidates share one read-only copy in the page cache.
+
+    :param player_ids1: the int32 ids of the first players.
+    :param player_ids2: the int32 ids of the second players.
+    :param scores: the actual scores of the first players.
+    :param keys: the player keys by the ids.
+    """
+
+    #: The directory which the log was saved to or loaded from.
+    path = None
+
+    def __init__(self, player_ids1, player_ids2, scores, keys=None):
+        self.player_ids1 = numpy.asarray(player_ids1, dtype=numpy.int32)
+        self.player_ids2 = numpy.asarray(player_ids2, dtype=numpy.int32)
+        self.scores = numpy.asarray(scores, dtype=numpy.float64)
+        if keys is None:
+            size = 0
+            if len(self):
+                size = int(max(self.player_ids1.max(),
+                               self.player_ids2.max())) + 1
+            keys = list(range(size))
+        self.keys = keys
+
+    @classmethod
+    def encode(cls, games):
+        """Encodes an iterable of ``(key1, key2, score)`` tuples."""
+        ids, keys = {}, []
+        player_ids1, player_ids2 = [], []
+        scores = []
+        for key1, key2, score in games:
+            for key, player_ids in ((key1, player_ids1),
+                                    (key2, player_ids2)):
+                try:
+                    player_ids.append(ids[key])
+                except KeyError:
+                    ids[key] = len(keys)
+                    player_ids.append(len(keys))
+                    keys.append(key)
+            scores.append(score)
+        return cls(player_ids1, player_ids2, scores, keys)
+
+    def save(self, path):
+        """Saves the log into a directory."""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        numpy.save(os.path.join(path, 'player_ids1.npy'), self.player_ids1)
+        numpy.save(os.path.join(path, 'player_ids2.npy'), self.player_ids2)
+        numpy.save(os.path.join(path, 'scores.npy'), self.scores)
+        with open(os.path.join(path, 'keys.pickle'), 'wb') as f:
+            pickle.dump(self.keys, f, pickle.HIGHEST_PROTOCOL)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        """Loads a log which :meth:`save` saved by memory mapping."""
+        arrays = [numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ['player_ids1', 'player_ids2', 'scores']]
+        with open(os.path.join(path, 'keys.pickle'), 'rb') as f:
+            keys = pickle.load(f)
+        log = cls(*arrays, keys=keys)
+        log.path = path
+        return log
+
+    @property
+    def players(self):
+        return len(self.keys)
+
+    def __len__(self):
+        return len(self.scores)
+
+
+def _replay(player_ids1, player_ids2, scores, players, initial, beta, bounds,
+            k_factors, provisional_k, provisional_games, start):
+    """The pure Python version of ``_elospeedups.replay``."""
+    values, times = [initial] * players, [0] * players
+    f_factor = 2 * beta
+    log_loss = brier = 0.
+    count = 0
+    for x, (player1, player2, score) in enumerate(zip(
+            player_ids1.tolist(), player_ids2.tolist(), scores.tolist())):
+        value1, value2 = values[player1], values[player2]
+        expect1 = 1. / (1 + 10 ** ((value2 - value1) / f_factor))
+        expect2 = 1. / (1 + 10 ** ((value1 - value2) / f_factor))
+        if x >= start:
+            e = min(max(expect1, 1e-15), 1 - 1e-15)
+            log_loss -= score * math.log(e) + (1 - score) * math.log(1 - e)
+            brier += (expect1 - score) ** 2
+            count += 1
+        if times[player1] < provisional_games:
+            k1 = provisional_k
+        else:
+            k1 = k_factors[bisect_right(bounds, value1)]
+        if times[player2] < provisional_games:
+            k2 = provisional_k
+        else:
+            k2 = k_factors[bisect_right(bounds, value2)]
+        values[player1] = value1 + k1 * (score - expect1)
+        values[player2] = value2 + k2 * ((1 - score) - expect2)
+        times[player1] += 1
+        times[player2] += 1
+    return log_loss, brier, count
+
+
+def evaluate(log, k_factor=K_FACTOR, beta=BETA, initial=INITIAL,
+             holdout=0.2):
+    """Replays the log from the initial ratings and scores the expected
+    scores of the held-out games, which are the last ``holdout`` fraction of
+    the games. A held-out game is scored before it is rated. The result is
+    the same as rating the games by :meth:`elo.Elo.rate_1vs1` in order.
+
+    It runs in C if the ``_elospeedups`` extension is built.
+
+    :param log: a :class:`MatchLog`.
+    :param k_factor: a number or a :class:`PiecewiseK`.
+    :returns: a dictionary of the mean ``log_loss`` and ``brier`` scores and
+              the number of the scored ``games``.
+    """
+    if isinstance(k_factor, PiecewiseK):
+        bounds, k_factors = k_factor.bounds, k_factor.k_factors
+        provisional_k = k_factor.provisional_k
+        if provisional_k is None:
+            provisional_k, provisional_games = 0., 0
+        else:
+            provisional_games = k_factor.provisional_games
+    elif callable(k_factor):
+        raise TypeError('Use PiecewiseK for a K-factor rule')
+    else:
+        bounds, k_factors = (), (k_factor,)
+        provisional_k, provisional_games = 0., 0
+    start = len(log) - int(len(log) * holdout)
+    replay = _replay if _elospeedups is None else _elospeedups.replay
+    log_loss, brier, count = replay(
+        log.player_ids1, log.player_ids2, log.scores, log.players,
+        float(initial), float(beta), bounds, k_factors, float(provisional_k),
+        provisional_games, start)
+    return {'log_loss': log_loss / max(count, 1),
+            'brier': brier / max(count, 1), 'games': count}
+
+
+def grid(**params):
+    """Makes the candidates of every combination of the parameter values.
+
+    >>> grid(k_factor=[10, 20], beta=[200])
+    [{'k_factor': 10, 'beta': 200}, {'k_factor': 20, 'beta': 200}]
+    """
+    names = list(params)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[params[name]
+                                              for name in names])]
+
+
+def sample(count, seed=None, **params):
+    """Makes ``count`` random candidates for a random search. A parameter is
+    drawn uniformly from a ``(low, high)`` tuple or chosen from a list.
+    """
+    rand = random.Random(seed)
+    candidates = []
+    for x in range(count):
+        candidate = {}
+        for name in sorted(params):
+            values = params[name]
+            if isinstance(values, tuple):
+                candidate[name] = rand.uniform(*values)
+            else:
+                candidate[name] = rand.choice(values)
+        candidates.append(candidate)
+    return candidates
+
+
+#: The logs which the worker processes have loaded by their paths.
+_logs = {}
+
+
+def _evaluate(task):
+    """Evaluates a candidate for :func:`fit`. It is a module-level function
+    to be picklable.
+    """
+    log, candidate, holdout = task
+    if not isinstance(log, MatchLog):
+        try:
+            log = _logs[log]
+        except KeyError:
+            loaded = MatchLog.load(log)
+            _logs[log] = loaded
+            log = loaded
+    return evaluate(log, holdout=holdout, **candidate)
+
+
+def fit(log, candidates, holdout=0.2, pool=None):
+    """Evaluates the candidates by :func:`evaluate` and sorts them by the
+    log-loss.
+
+    :param log: a :class:`MatchLog`. If it is saved, the processes of the
+                pool load it by memory mapping instead of receiving a copy.
+    :param candidates: an iterable of dictionaries of the keyword arguments
+                       of :func:`evaluate`, such as :func:`grid` makes.
+    :param pool: an object which has ``map(func, iterable)`` such as
+                 :class:`multiprocessing.pool.Pool` to evaluate the
+                 candidates in parallel. The candidates are evaluated in the
+                 current thread if it is not given.
+    :returns: a list of ``(candidate, result)`` tuples. The best is first.
+    """
+    candidates = list(candidates)
+    shared = log if log.path is None else log.path
+    tasks = [(shared, candidate, holdout) for candidate in candidates]
+    results = (map if pool is None else pool.map)(_evaluate, tasks)
+    return sorted(zip(candidates, results),
+                  key=lambda item: item[1]['log_loss'])
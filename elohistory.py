@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+    elohistory
+    ~~~~~~~~~~
+
+    A compressed history of the ratings of players.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from elo import EPOCH
+
+
+__all__ = ['RatingHistory']
+
+
+def _encode(ticks, values):
+    """Encodes the entries after the first as varints of the differences.
+    The differences of the values are zigzag-encoded to be unsigned.
+    """
+    data = bytearray()
+    for x in range(1, len(ticks)):
+        tick_delta = ticks[x] - ticks[x - 1]
+        value_delta = values[x] - values[x - 1]
+        value_delta = value_delta * 2 if value_delta >= 0 \
+            else -value_delta * 2 - 1
+        for delta in (tick_delta, value_delta):
+            while delta >= 0x80:
+                data.append(delta & 0x7f | 0x80)
+                delta >>= 7
+            data.append(delta)
+    return bytes(data)
+
+
+def _decode(data, tick, value, until=None):
+    """Decodes a chunk which starts from the tick and the value into lists
+    of the ticks and the values. The entries after the tick ``until`` are
+    not decoded.
+    """
+    ticks, values = [tick], [value]
+    data = bytearray(data)
+    x, size = 0, len(data)
+    while x < size:
+        byte = data[x]
+        x += 1
+        delta, shift = byte & 0x7f, 7
+        while byte & 0x80:
+            byte = data[x]
+            x += 1
+            delta |= (byte & 0x7f) << shift
+            shift += 7
+        tick += delta
+        if until is not None and tick > until:
+            break
+        byte = data[x]
+        x += 1
+        delta, shift = byte & 0x7f, 7
+        while byte & 0x80:
+            byte = data[x]
+            x += 1
+            delta |= (byte & 0x7f) << shift
+            shift += 7
+        value += (delta >> 1) ^ -(delta & 1)
+        ticks.append(tick)
+        values.append(value)
+    return ticks, values
+
+
+class _Track(object):
+    """The history of a player. The sealed chunks are delta-encoded and
+    indexed by their first ticks and values. The last chunk is open.
+    """
+
+    __slots__ = ('first_ticks', 'first_values', 'chunks', 'ticks', 'values')
+
+    def __init__(self):
+        self.first_ticks = array('q')
+        self.first_values = array('q')
+        self.chunks = []
+        self.ticks = array('q')
+        self.values = array('q')
+
+    def chunk(self, x, until=None):
+        """Decodes the ``x``-th chunk. The open chunk is the last."""
+        if x == len(self.chunks):
+            return self.ticks, self.values
+        return _decode(self.chunks[x], self.first_ticks[x],
+                       self.first_values[x], until)
+
+    def find(self, tick):
+        """Finds the index of the chunk which has the last entry at or
+        before the tick. ``-1`` if there is no such entry.
+        """
+        if self.ticks and self.ticks[0] <= tick:
+            return len(self.chunks)
+        return bisect_right(self.first_ticks, tick) - 1
+
+
+class RatingHistory(object):
+    """Records the rating values of players over time for point-in-time and
+    range queries. Set it as :attr:`elo.Elo.history` to record the ratings
+    which :meth:`elo.Elo.rate` rates with the player keys.
+
+    The entries of a player are stored in chunks. A full chunk is sealed by
+    encoding the differences of the times and the values as variable-length
+    integers, so an entry takes a few bytes. The chunks are indexed by
+    their first times, so a query decodes only the chunks in the range after
+    a binary search.
+
+    The values are rounded to ``value_resolution`` and the times to
+    ``time_resolution`` seconds. The rounding errors don't accumulate.
+
+    >>> history = RatingHistory()
+    >>> history.record('alice', 1200, datetime(2012, 1, 1))
+    >>> history.record('alice', 1212.5, datetime(2012, 1, 3))
+    >>> history.at('alice', datetime(2012, 1, 2))
+    1200.0
+
+    :param value_resolution: the resolution of the values.
+    :param time_resolution: the resolution of the times in seconds.
+    :param chunk_size: the number of the entries in a chunk.
+    """
+
+    #: The function which returns the current time for the ratings without
+    #: ``rated_at``.
+    clock = staticmethod(datetime.utcnow)
+
+    def __init__(self, value_resolution=0.001, time_resolution=1.,
+                 chunk_size=64):
+        self.value_resolution = value_resolution
+        self.time_resolution = time_resolution
+        self.chunk_size = chunk_size
+        self._tracks = {}
+
+    def _tick(self, at):
+        return int(round((at - EPOCH).total_seconds() /
+                         self.time_resolution))
+
+    def _time(self, tick):
+        return EPOCH + timedelta(seconds=tick * self.time_resolution)
+
+    def record(self, key, rating, at=None):
+        """Records a rating of the player.
+
+        :param at: the time of the rating. The ``rated_at`` of the rating or
+                   the current time by default. The times of a player must
+                   not decrease.
+        """
+        if at is None:
+            at = getattr(rating, 'rated_at', None) or self.clock()
+        tick = self._tick(at)
+        value = int(round(float(rating) / self.value_resolution))
+        try:
+            track = self._tracks[key]
+        except KeyError:
+            track = self._tracks[key] = _Track()
+        # the open chunk is empty only before the first entry
+        ticks = track.ticks
+        if ticks and tick < ticks[-1]:
+            raise ValueError('Recorded out of time order: %r' % (key,))
+        if len(ticks) >= self.chunk_size:
+            # seals the open chunk
+            track.first_ticks.append(ticks[0])
+            track.first_values.append(track.values[0])
+            track.chunks.append(_encode(ticks, track.values))
+            track.ticks, track.values = array('q'), array('q')
+        track.ticks.append(tick)
+        track.values.append(value)
+
+    def at(self, key, when):
+        """Gets the rating value of the player at the time. ``None`` if the
+        player was not rated yet.
+        """
+        track = self._tracks.get(key)
+        if track is None:
+            return None
+        tick = self._tick(when)
+        x = track.find(tick)
+        if x < 0:
+            return None
+        ticks, values = track.chunk(x, tick)
+        return values[bisect_right(ticks, tick) - 1] * self.value_resolution
+
+    def range(self, key, start=None, end=None):
+        """Gets the ``(time, value)`` tuples of the player between the times
+        inclusive.
+        """
+        track = self._tracks.get(key)
+        if track is None:
+            return []
+        start_tick = None if start is None else self._tick(start)
+        end_tick = None if end is None else self._tick(end)
+        x = 0 if start_tick is None else max(track.find(start_tick), 0)
+        entries = []
+        for x in range(x, len(track.chunks) + 1):
+            ticks, values = track.chunk(x, end_tick)
+            for tick, value in zip(ticks, values):
+                if end_tick is not None and tick > end_tick:
+                    return entries
+                if start_tick is None or tick >= start_tick:
+                    entries.append((self._time(tick),
+                                    value * self.value_resolution))
+        return entries
+
+    def __contains__(self, key):
+        return key in self._tracks
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    def __len__(self):
+        return len(self._tracks)
+
+    @property
+    def nbytes(self):
+        """The bytes of the recorded entries."""
+        nbytes = 0
+        for track in self._tracks.values():
+            nbytes += sum(map(len, track.chunks))
+            for column in (track.first_ticks, track.first_values,
+                           track.ticks, track.values):
+                nbytes += len(column) * column.itemsize
+        return nbytes
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    elomatch
+    ~~~~~~~~
+
+    Matchmaking by :meth:`elo.Elo.quality_1vs1` on a sorted rating index.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from bisect import bisect_left, bisect_right
+
+from elo import global_env
+
+
+__all__ = ['MatchQueue']
+
+
+class MatchQueue(object):
+    """A queue of players waiting for 1 vs 1 games. The ratings are kept
+    sorted, and the quality of a game depends only on the rating difference,
+    so a quality threshold becomes a rating difference by
+    :meth:`elo.Elo.max_diff_1vs1` instead of trying every pair.
+
+    >>> queue = MatchQueue()
+    >>> queue.add('alice', 1200)
+    >>> queue.add('bob', 1800)
+    >>> queue.add('carol', 1250)
+    >>> queue.best_opponent('alice', min_quality=0.5)
+    'carol'
+    >>> queue.pairs()
+    [('alice', 'carol')]
+
+    :param env: the environment. The global environment by default.
+    """
+
+    def __init__(self, env=None):
+        if env is None:
+            env = global_env()
+        self.env = env
+        self.ratings = {}
+        self._values = []
+        self._keys = []
+
+    def add(self, key, rating):
+        """Adds a player to the queue."""
+        if key in self.ratings:
+            raise KeyError('Already queued player: %r' % (key,))
+        value = float(rating)
+        x = bisect_right(self._values, value)
+        self._values.insert(x, value)
+        self._keys.insert(x, key)
+        self.ratings[key] = rating
+
+    def remove(self, key):
+        """Removes a player from the queue."""
+        x = self._index(key)
+        del self._values[x]
+        del self._keys[x]
+        del self.ratings[key]
+
+    def _index(self, key):
+        value = float(self.ratings[key])
+        start = bisect_left(self._values, value)
+        stop = bisect_right(self._values, value)
+        return self._keys.index(key, start, stop)
+
+    def __contains__(self, key):
+        return key in self.ratings
+
+    def __len__(self):
+        return len(self._keys)
+
+    def best_opponent(self, key, min_quality=0.):
+        """Finds the opponent of the player with the best quality. ``None``
+        if no opponent reaches the minimum quality.
+        """
+        x = self._index(key)
+        value = self._values[x]
+        max_diff = self.env.max_diff_1vs1(min_quality)
+        best, best_diff = None, None
+        for y in (x - 1, x + 1):
+            if not 0 <= y < len(self._values):
+                continue
+            diff = abs(self._values[y] - value)
+            if diff <= max_diff and (best is None or diff < best_diff):
+                best, best_diff = self._keys[y], diff
+        return best
+
+    def pairs(self, min_quality=0.):
+        """Pairs up the players to make the most games whose quality is at
+        least the minimum quality. Among them, the total rating difference is
+        the smallest. The queue is not changed.
+
+        :returns: a list of the ``(key1, key2)`` tuples. The first player has
+                  the lower rating.
+        """
+        values = self._values
+        max_diff = self.env.max_diff_1vs1(min_quality)
+        # only neighbors are paired in the best pairing. best[x] is the number
+        # of games and the negative total difference for the first x players.
+        best = [(0, 0.), (0, 0.)]
+        for x in range(2, len(values) + 1):
+            skip = best[x - 1]
+            diff = values[x - 1] - values[x - 2]
+            if diff <= max_diff:
+                pair = best[x - 2]
+                best.append(max(skip, (pair[0] + 1, pair[1] - diff)))
+            else:
+                best.append(skip)
+        pairs = []
+        x = len(values)
+        while x >= 2:
+            if best[x] == best[x - 1]:
+                x -= 1
+            else:
+                pairs.append((self._keys[x - 2], self._keys[x - 1]))
+                x -= 2
+        pairs.reverse()
+        return pairs
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    elomatrix
+    ~~~~~~~~~
+
+    Pairwise expected scores and qualities of large player pools. It
+    requires NumPy.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+import numpy
+
+from elo import global_env
+
+
+__all__ = ['expect_matrix', 'quality_matrix', 'quality_pairs']
+
+
+def _values(ratings, env):
+    return numpy.fromiter((float(env.ensure_rating(rating))
+                           for rating in ratings), float)
+
+
+def _qualities(expects):
+    return 2 * (0.5 - abs(0.5 - expects))
+
+
+def _matrix(ratings, env, out, dtype, block_size, quality):
+    if env is None:
+        env = global_env()
+    values = _values(ratings, env)
+    size = len(values)
+    if out is None:
+        out = numpy.empty((size, size), dtype)
+    elif not hasattr(out, 'shape'):
+        out = numpy.lib.format.open_memmap(out, 'w+', dtype, (size, size))
+    elif out.shape != (size, size):
+        raise ValueError('The output must be %d by %d' % (size, size))
+    # only the blocks on and above the diagonal are calculated. The others
+    # are mirrored because expect(b, a) is 1 - expect(a, b).
+    for x in range(0, size, block_size):
+        rows = values[x:x + block_size, numpy.newaxis]
+        for y in range(x, size, block_size):
+            block = env.expect_many(
+                values[numpy.newaxis, y:y + block_size] - rows)
+            if quality:
+                block = _qualities(block)
+                mirrored = block.T
+            else:
+                mirrored = 1 - block.T
+            out[x:x + block_size, y:y + block_size] = block
+            if y != x:
+                out[y:y + block_size, x:x + block_size] = mirrored
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+
+def expect_matrix(ratings, env=None, out=None, dtype=float,
+                  block_size=1024):
+    """Calculates the expected scores of every pair of the players in square
+    blocks. The working memory is bounded by the block size however many
+    players there are.
+
+    >>> expect_matrix([1200, 1400]).round(3).tolist()
+    [[0.5, 0.24], [0.76, 0.5]]
+
+    :param ratings: the ratings of the players.
+    :param env: the environment. The global environment by default.
+    :param out: an array to write into, or a path of a ``.npy`` file which is
+                created and written by memory mapping. A new array by
+                default.
+    :param dtype: the data type of a new output.
+    :param block_size: the number of the rows and columns of a block.
+    :returns: the output. ``[i, j]`` is the expected score of the ``i``-th
+              player by the ``j``-th player.
+    """
+    return _matrix(ratings, env, out, dtype, block_size, False)
+
+
+def quality_matrix(ratings, env=None, out=None, dtype=float,
+                   block_size=1024):
+    """Calculates :meth:`elo.Elo.quality_1vs1` of every pair of the players
+    in square blocks. See :func:`expect_matrix` for the parameters.
+    """
+    return _matrix(ratings, env, out, dtype, block_size, True)
+
+
+def quality_pairs(ratings, min_quality, env=None, block_size=65536):
+    """Finds the pairs of the players whose :meth:`elo.Elo.quality_1vs1` is
+    at least ``min_quality`` in a sparse form. The quality depends only on
+    the rating difference, so each player is compared only with the players
+    within :meth:`elo.Elo.max_diff_1vs1` in sorted order. The time is
+    proportional to the number of the pairs found, and the candidate pairs are
+    processed in blocks of about ``block_size`` pairs.
+
+    >>> rows, cols, qualities = quality_pairs([1200, 1800, 1250], 0.5)
+    >>> rows.tolist(), cols.tolist(), qualities.round(3).tolist()
+    ([0], [2], [0.857])
+
+    :param ratings: the ratings of the players.
+    :param min_quality: the minimum quality.
+    :param env: the environment. The global environment by default.
+    :returns: a tuple of the first player indices, the second player indices
+              and the qualities. The first index is less than the second.
+              It is the COO format of :mod:`scipy.sparse`.
+    """
+    if env is None:
+        env = global_env()
+    values = _values(ratings, env)
+    order = numpy.argsort(values, kind='stable')
+    sorted_values = values[order]
+    # a margin for the rounding of the expectation table and the logarithm
+    max_diff = env.max_diff_1vs1(min_quality) * 1.01 + 1
+    uppers = numpy.searchsorted(sorted_values, sorted_values + max_diff,
+                                'right')
+    counts = uppers - numpy.arange(len(values)) - 1
+    ends = numpy.cumsum(counts)
+    rows, cols, qualities = [], [], []
+    x = 0
+    while x < len(values):
+        # the sorted players whose candidates fit in a block
+        done = ends[x - 1] if x else 0
+        y = max(x + 1, int(numpy.searchsorted(ends, done + block_size,
+                                              'right')))
+        firsts = numpy.repeat(numpy.arange(x, y), counts[x:y])
+        if len(firsts):
+            starts = numpy.repeat(numpy.cumsum(counts[x:y]) - counts[x:y],
+                                  counts[x:y])
+            seconds = firsts + 1 + numpy.arange(len(firsts)) - starts
+            block = _qualities(env.expect_many(sorted_values[seconds] -
+                                               sorted_values[firsts]))
+            found = block >= min_quality
+            first, second = order[firsts[found]], order[seconds[found]]
+            rows.append(numpy.minimum(first, second))
+            cols.append(numpy.maximum(first, second))
+            qualities.append(block[found])
+        x = y
+    if not rows:
+        empty = numpy.array([], dtype=numpy.intp)
+        return empty, empty.copy(), numpy.array([])
+    return (numpy.concatenate(rows), numpy.concatenate(cols),
+            numpy.concatenate(qualities))
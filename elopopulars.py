@@ -1,20 +1,20 @@
 # -*- coding: utf-8 -*-
-from elo import CountedRating, Elo
+from elo import CompactCountedRating, CountedRating, Elo
 
 
 __all__ = ['fide30', 'fide25', 'fide', 'uscf']
 
 
-class FIDERating(CountedRating):
+class _FIDE(object):
 
-    stable = False
+    __slots__ = ()
 
     def __init__(self, value=None, times=0, stable=None):
         if stable is not None:
             self.stable = stable
             if stable:
                 times = max(30, times)
-        super(FIDERating, self).__init__(value, times)
+        super(_FIDE, self).__init__(value, times)
         if stable is None:
             self.stable = self._should_stable()
 
@@ -22,11 +22,28 @@ class FIDERating(CountedRating):
         return self.times >= 30 and self.value >= 2400
 
     def rated(self, value):
-        rated = super(FIDERating, self).rated(value)
+        rated = super(_FIDE, self).rated(value)
         if rated._should_stable():
             rated.stable = True
         return rated
 
+    def update(self, value):
+        super(_FIDE, self).update(value)
+        # the same as :meth:`rated` which doesn't inherit the stable flag
+        self.stable = self._should_stable()
+        return self
+
+
+class FIDERating(_FIDE, CountedRating):
+
+    stable = False
+
+
+class CompactFIDERating(_FIDE, CompactCountedRating):
+    """A memory-compact :class:`FIDERating`."""
+
+    __slots__ = ('stable',)
+
 
 def make_fide_k_factor(scarce_games, too_low_rating, stabled):
     def fide_k_factor(rating):
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    eloregistry
+    ~~~~~~~~~~~
+
+    A thread-safe registry of ratings.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+import threading
+
+from elo import global_env
+
+
+__all__ = ['Registry']
+
+
+class Registry(object):
+    """A dictionary of ratings by player keys which many threads can rate
+    at the same time without losing updates. The players are striped over a
+    fixed number of locks by the hashes of the keys. A game takes the locks
+    of its players in the order of the stripes, so two games never wait for
+    each other in a cycle.
+
+    >>> from elo import Elo
+    >>> registry = Registry(Elo(k_factor=25))
+    >>> registry.rate_1vs1('alice', 'bob')
+    (1212.5, 1187.5)
+
+    :param env: the environment. The global environment by default.
+    :param stripes: the number of the locks.
+    """
+
+    def __init__(self, env=None, stripes=64):
+        if env is None:
+            env = global_env()
+        self.env = env
+        self._locks = [threading.Lock() for x in range(stripes)]
+        # the ratings are boxed in 1-tuples, so that the optimistic updates can
+        # compare them by identity even if ratings are equal numbers.
+        self._boxes = {}
+
+    def _stripes(self, keys):
+        return sorted(set(hash(key) % len(self._locks) for key in keys))
+
+    def _acquire(self, keys):
+        stripes = self._stripes(keys)
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        return stripes
+
+    def _release(self, stripes):
+        for stripe in reversed(stripes):
+            self._locks[stripe].release()
+
+    def _box(self, key):
+        try:
+            return self._boxes[key]
+        except KeyError:
+            stripes = self._acquire([key])
+            try:
+                return self._boxes.setdefault(key,
+                                              (self.env.create_rating(),))
+            finally:
+                self._release(stripes)
+
+    def __getitem__(self, key):
+        return self._boxes[key][0]
+
+    def __setitem__(self, key, rating):
+        stripes = self._acquire([key])
+        try:
+            self._boxes[key] = (rating,)
+        finally:
+            self._release(stripes)
+
+    def __contains__(self, key):
+        return key in self._boxes
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __iter__(self):
+        return iter(list(self._boxes))
+
+    def get(self, key, default=None):
+        box = self._boxes.get(key)
+        return default if box is None else box[0]
+
+    def rate(self, key, series):
+        """Rates the player by :meth:`elo.Elo.rate` while holding the locks of
+        the player and the opponents. Unknown players start with the initial
+        rating.
+
+        :param series: a sequence of ``(score, other_key)`` tuples.
+        :returns: the new rating.
+        """
+        for other in [key] + [other for score, other in series]:
+            self._box(other)
+        stripes = self._acquire([key] + [other for score, other in series])
+        try:
+            rated = self.env.rate(self._boxes[key][0], [
+                (score, self._boxes[other][0]) for score, other in series],
+                key=key)
+            self._boxes[key] = (rated,)
+        finally:
+            self._release(stripes)
+        return rated
+
+    def rate_1vs1(self, key1, key2, drawn=False):
+        """Rates the players by :meth:`elo.Elo.rate_1vs1` while holding their
+        locks. Unknown players start with the initial rating.
+
+        :returns: the new ratings.
+        """
+        self._box(key1), self._box(key2)
+        stripes = self._acquire([key1, key2])
+        try:
+            rated = self.env.rate_1vs1(self._boxes[key1][0],
+                                       self._boxes[key2][0], drawn,
+                                       (key1, key2))
+            self._boxes[key1], self._boxes[key2] = (rated[0],), (rated[1],)
+        finally:
+            self._release(stripes)
+        return rated
+
+    def rate_1vs1_optimistic(self, key1, key2, drawn=False, retries=None):
+        """Rates the players by :meth:`elo.Elo.rate_1vs1` without holding the
+        locks during the calculation. The new ratings are committed by
+        compare-and-swap, and the game is rated again if another thread has
+        changed either rating meanwhile.
+
+        :param retries: the maximum number of retries. Unlimited by default.
+        :returns: the new ratings.
+        :raises RuntimeError: the retries are exhausted.
+        """
+        attempts = 0
+        while True:
+            box1, box2 = self._box(key1), self._box(key2)
+            rated = self.env.rate_1vs1(box1[0], box2[0], drawn)
+            stripes = self._acquire([key1, key2])
+            try:
+                if self._boxes[key1] is box1 and self._boxes[key2] is box2:
+                    self._boxes[key1], self._boxes[key2] = \
+                        (rated[0],), (rated[1],)
+                    # only the committed attempt is recorded
+                    self.env._record(key1, rated[0])
+                    self.env._record(key2, rated[1])
+                    return rated
+            finally:
+                self._release(stripes)
+            attempts += 1
+            if retries is not None and attempts > retries:
+                raise RuntimeError('Too many conflicts to rate %r and %r' %
+                                   (key1, key2))
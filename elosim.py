@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    elosim
+    ~~~~~~
+
+    Monte Carlo simulations of tournaments on Elo. It requires NumPy.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+import numpy
+
+from elo import WIN, DRAW, LOSS, global_env
+
+
+__all__ = ['simulate_bracket', 'simulate_swiss']
+
+
+def _k_factors(env, values, times):
+    """The K-factors of the ratings. A K-factor which has a vectorized
+    ``many(values, times)`` method such as :class:`elofit.PiecewiseK` is
+    evaluated at once. Another callable K-factor is evaluated for each rating
+    in Python, which sees the games played in the simulation as the ``times``
+    of a counted rating class.
+    """
+    if not callable(env.k_factor):
+        return env.k_factor
+    many = getattr(env.k_factor, 'many', None)
+    if many is not None:
+        return many(values, times)
+    counted = hasattr(env.rating_class, 'times')
+    k_factors = numpy.empty(values.shape)
+    flat = k_factors.reshape(-1)
+    for x, (value, times) in enumerate(zip(values.flat, times.flat)):
+        if counted:
+            rating = env.create_rating(float(value), int(times))
+        else:
+            rating = env.create_rating(float(value))
+        flat[x] = env._k_factor(rating)
+    return k_factors
+
+
+def _draw_scores(rng, expects, draw_rate):
+    """Draws the actual scores of the games whose expected scores are
+    ``expects``. A game is drawn with the probability ``draw_rate`` at most,
+    which is limited so that the expected score is kept.
+    """
+    draws = numpy.minimum(draw_rate, 2 * numpy.minimum(expects, 1 - expects))
+    x = rng.random(expects.shape)
+    wins = x < expects - draws / 2
+    drawn = ~wins & (x < expects + draws / 2)
+    return numpy.where(wins, WIN, numpy.where(drawn, DRAW, LOSS))
+
+
+def _simulate_bracket(task):
+    """Simulates a chunk of replicas for :func:`simulate_bracket`. It is a
+    module-level function to be picklable.
+    """
+    env, values, times, replicas, seed = task
+    rng = numpy.random.default_rng(seed)
+    size = len(values)
+    rounds = size.bit_length() - 1
+    # the values, game counts and ids of the players who are still in the
+    # bracket, in bracket order
+    values = numpy.tile(values, (replicas, 1))
+    times = numpy.tile(times, (replicas, 1))
+    players = numpy.tile(numpy.arange(size), (replicas, 1))
+    counts = numpy.zeros(size * (rounds + 1), dtype=numpy.int64)
+    for r in range(rounds):
+        values1, values2 = values[:, 0::2], values[:, 1::2]
+        times1, times2 = times[:, 0::2], times[:, 1::2]
+        players1, players2 = players[:, 0::2], players[:, 1::2]
+        expects = env.expect_many(values2 - values1)
+        won = rng.random(expects.shape) < expects
+        # only the winners play again, so only they are rated
+        new_values1 = values1 + _k_factors(env, values1, times1) * \
+            (WIN - expects)
+        new_values2 = values2 + _k_factors(env, values2, times2) * \
+            (WIN - env.expect_many(values1 - values2))
+        losers = numpy.where(won, players2, players1)
+        counts += numpy.bincount((losers * (rounds + 1) + r).ravel(),
+                                 minlength=len(counts))
+        values = numpy.where(won, new_values1, new_values2)
+        times = numpy.where(won, times1, times2) + 1
+        players = numpy.where(won, players1, players2)
+    counts += numpy.bincount((players * (rounds + 1) + rounds).ravel(),
+                             minlength=len(counts))
+    return counts.reshape(size, rounds + 1)
+
+
+def _simulate_swiss(task):
+    """Simulates a chunk of replicas for :func:`simulate_swiss`. It is a
+    module-level function to be picklable.
+    """
+    env, values, times, rounds, draw_rate, replicas, seed = task
+    rng = numpy.random.default_rng(seed)
+    size = len(values)
+    pairs = size // 2
+    values = numpy.tile(values, (replicas, 1))
+    times = numpy.tile(times, (replicas, 1))
+    points = numpy.zeros((replicas, size))
+    for r in range(rounds):
+        # pairs the neighbors by points and then by ratings
+        order = numpy.lexsort((rng.random((replicas, size)), -values,
+                               -points))
+        players1, players2 = order[:, 0:2 * pairs:2], order[:, 1:2 * pairs:2]
+        values1 = numpy.take_along_axis(values, players1, 1)
+        values2 = numpy.take_along_axis(values, players2, 1)
+        times1 = numpy.take_along_axis(times, players1, 1)
+        times2 = numpy.take_along_axis(times, players2, 1)
+        expects1 = env.expect_many(values2 - values1)
+        expects2 = env.expect_many(values1 - values2)
+        scores = _draw_scores(rng, expects1, draw_rate)
+        numpy.put_along_axis(values, players1, values1 + _k_factors(
+            env, values1, times1) * (scores - expects1), 1)
+        numpy.put_along_axis(values, players2, values2 + _k_factors(
+            env, values2, times2) * ((WIN - scores) - expects2), 1)
+        numpy.put_along_axis(times, players1, times1 + 1, 1)
+        numpy.put_along_axis(times, players2, times2 + 1, 1)
+        numpy.put_along_axis(points, players1, numpy.take_along_axis(
+            points, players1, 1) + scores, 1)
+        numpy.put_along_axis(points, players2, numpy.take_along_axis(
+            points, players2, 1) + (WIN - scores), 1)
+        if size % 2:
+            # the last player gets a bye
+            bye = order[:, -1:]
+            numpy.put_along_axis(points, bye, numpy.take_along_axis(
+                points, bye, 1) + WIN, 1)
+    # ties on points are broken at random
+    order = numpy.lexsort((rng.random((replicas, size)), -points))
+    places = numpy.arange(size)
+    return numpy.bincount((order * size + places).ravel(),
+                          minlength=size * size).reshape(size, size)
+
+
+def _simulate(func, args, ratings, replicas, env, seed, pool, chunksize):
+    if env is None:
+        env = global_env()
+    ratings = [env.ensure_rating(rating) for rating in ratings]
+    values = numpy.array([float(rating) for rating in ratings])
+    times = numpy.array([getattr(rating, 'times', None) or 0
+                         for rating in ratings], dtype=numpy.int64)
+    # a seed per chunk makes the results independent of the pool
+    chunks = range(0, replicas, chunksize)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(env, values, times) + args +
+             (min(chunksize, replicas - x), chunk_seed)
+             for x, chunk_seed in zip(chunks, seeds)]
+    results = (map if pool is None else pool.map)(func, tasks)
+    return sum(results) / float(replicas)
+
+
+def simulate_bracket(ratings, replicas, env=None, seed=None, pool=None,
+                     chunksize=10000):
+    """Simulates a single-elimination bracket ``replicas`` times. The games
+    of a round are played at once in all replicas as array operations. The
+    winner of a game is drawn from :meth:`elo.Elo.expect`, and the winner is
+    rated by the environment between rounds.
+
+    >>> odds = simulate_bracket([2000, 1800, 1600, 1400], 1000, seed=0)
+    >>> odds.shape
+    (4, 3)
+    >>> int(odds[:, 2].argmax())
+    0
+
+    :param ratings: the ratings of the players in bracket order. The first
+                    round pairs the first and second players, the third and
+                    fourth players and so on. The number of the players must
+                    be a power of 2.
+    :param replicas: the number of the simulated brackets.
+    :param env: the environment. The global environment by default. A
+                callable K-factor is evaluated for every rating of every
+                replica in Python, which is much slower than a number, unless
+                it is vectorized like :class:`elofit.PiecewiseK`. For example,
+                ``PiecewiseK([32, 24, 16], [2100, 2400])`` is the K-factor of
+                :data:`elopopulars.uscf`.
+    :param seed: the seed of the random streams. The results are
+                 reproducible with the same seed and chunk size.
+    :param pool: an object which has ``map(func, iterable)`` to simulate
+                 the chunks in parallel, such as
+                 :class:`multiprocessing.pool.Pool`. A process pool requires
+                 a picklable environment.
+    :param chunksize: the number of replicas in a chunk. It bounds the
+                      memory usage.
+    :returns: a NumPy array of the probabilities that each player wins
+              exactly ``w`` games in the shape of ``(players, rounds + 1)``.
+              The last column is the chance to win the bracket.
+    """
+    size = len(ratings)
+    if size < 2 or size & (size - 1):
+        raise ValueError('The number of the players must be a power of 2')
+    if replicas <= 0:
+        raise ValueError('The number of the replicas must be positive')
+    return _simulate(_simulate_bracket, (), ratings, replicas, env, seed,
+                     pool, chunksize)
+
+
+def simulate_swiss(ratings, rounds, replicas, env=None, draw_rate=0.,
+                   seed=None, pool=None, chunksize=10000):
+    """Simulates a Swiss-system tournament ``replicas`` times. Each round
+    pairs the neighbors sorted by points and then by ratings without
+    avoiding rematches. If the number of the players is odd, the lowest
+    player gets a bye which scores a win. The results are drawn from
+    :meth:`elo.Elo.expect`, and all players are rated by the environment
+    between rounds. Ties on points in the final standings are broken at
+    random.
+
+    :param ratings: the ratings of the players.
+    :param rounds: the number of the rounds.
+    :param replicas: the number of the simulated tournaments.
+    :param draw_rate: the probability of a draw of even players. The draws
+                      are limited so that the expected scores are kept.
+    :returns: a NumPy array of the probabilities that each player finishes
+              in each place in the shape of ``(players, players)``. The
+              first column is the chance to win the tournament.
+
+    See :func:`simulate_bracket` for the other parameters.
+    """
+    if replicas <= 0:
+        raise ValueError('The number of the replicas must be positive')
+    return _simulate(_simulate_swiss, (rounds, draw_rate), ratings,
+                     replicas, env, seed, pool, chunksize)
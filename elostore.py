@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+    elostore
+    ~~~~~~~~
+
+    A memory-mapped file of ratings which processes can share.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+import mmap
+import struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from elo import global_env
+from elotable import from_record, to_record
+
+
+__all__ = ['RatingStore']
+
+
+#: The header of a store file: the magic bytes and the number of records.
+HEADER = struct.Struct('<8sQ')
+#: A record of a store file: value, rated_at as seconds since the epoch (NaN
+#: if it is not rated yet), times and the stable flag.
+RECORD = struct.Struct('<ddqB7x')
+MAGIC = b'ELOSTOR1'
+
+
+class RatingStore(object):
+    """A fixed-width binary file of ratings by integer player ids, backed by
+    :mod:`mmap`. Opening it doesn't read the records, and processes which open
+    the same file share one copy in the page cache.
+
+    A record is converted to a rating object of the environment's rating
+    class when it is read and written back when it is assigned, so the store
+    can be passed to :meth:`elo.Elo.rate_rounds` or :meth:`elo.Elo.rate_stream`
+    as the ratings.
+
+    >>> import os, tempfile
+    >>> from elo import Elo
+    >>> path = os.path.join(tempfile.mkdtemp(), 'ratings')
+    >>> store = RatingStore.create(path, 2, env=Elo(25))
+    >>> store.rate_1vs1(0, 1)
+    >>> store.value(0), store.value(1)
+    (1212.5, 1187.5)
+    >>> store.close()
+
+    :param path: the path of the store file.
+    :param env: the environment. The global environment by default.
+    :param readonly: maps the file read-only.
+    """
+
+    def __init__(self, path, env=None, readonly=False):
+        if env is None:
+            env = global_env()
+        self.env = env
+        self.path = path
+        self.readonly = readonly
+        with open(path, 'rb' if readonly else 'r+b') as f:
+            access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+            self._mmap = mmap.mmap(f.fileno(), 0, access=access)
+        magic, self.size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a rating store: %r' % (path,))
+
+    @classmethod
+    def create(cls, path, size, env=None):
+        """Creates a store file of ``size`` players with the initial rating
+        and opens it.
+        """
+        if env is None:
+            env = global_env()
+        record = RECORD.pack(float(env.initial), float('nan'), 0, False)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, size))
+            chunk = 4096
+            for x in range(0, size, chunk):
+                f.write(record * min(chunk, size - x))
+        return cls(path, env)
+
+    def _offset(self, player_id):
+        if not 0 <= player_id < self.size:
+            raise IndexError('Player id out of range: %r' % (player_id,))
+        return HEADER.size + RECORD.size * player_id
+
+    def value(self, player_id):
+        """Reads only the rating value of the player."""
+        return struct.unpack_from('<d', self._mmap,
+                                  self._offset(player_id))[0]
+
+    def __getitem__(self, player_id):
+        value, rated_at, times, stable = \
+            RECORD.unpack_from(self._mmap, self._offset(player_id))
+        return from_record(value, times, rated_at, stable, self.env)
+
+    def __setitem__(self, player_id, rating):
+        value, times, rated_at, stable = to_record(rating)
+        RECORD.pack_into(self._mmap, self._offset(player_id), value, rated_at,
+                         times, stable)
+
+    def __contains__(self, player_id):
+        return 0 <= player_id < self.size
+
+    def __len__(self):
+        return self.size
+
+    def rate(self, player_id, series):
+        """Rates the player by :meth:`elo.Elo.rate` and writes the new rating
+        in place.
+
+        :param series: a sequence of ``(score, other_player_id)`` tuples.
+        """
+        series = [(score, self[other]) for score, other in series]
+        self[player_id] = self.env.rate(self[player_id], series,
+                                        key=player_id)
+
+    def rate_1vs1(self, player_id1, player_id2, drawn=False):
+        """Rates the players by :meth:`elo.Elo.rate_1vs1` and writes the new
+        ratings in place.
+        """
+        self[player_id1], self[player_id2] = \
+            self.env.rate_1vs1(self[player_id1], self[player_id2], drawn,
+                               (player_id1, player_id2))
+
+    def records(self):
+        """Makes a NumPy structured array over the records without copying.
+        It requires NumPy.
+        """
+        dtype = numpy.dtype({'names': ['value', 'rated_at', 'times',
+                                       'stable'],
+                             'formats': ['<f8', '<f8', '<i8', 'u1'],
+                             'offsets': [0, 8, 16, 24],
+                             'itemsize': RECORD.size})
+        return numpy.frombuffer(self._mmap, dtype, self.size, HEADER.size)
+
+    def flush(self):
+        """Flushes the changes to the file."""
+        self._mmap.flush()
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
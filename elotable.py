@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    elotable
+    ~~~~~~~~
+
+    Columnar import and export of ratings. CSV is built in, and Arrow and
+    Parquet require :mod:`pyarrow`.
+
+    :copyright: (c) 2012 by Heungsub Lee
+    :license: BSD, see LICENSE for more details.
+"""
+from array import array
+import csv
+from datetime import datetime, timedelta
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from elo import EPOCH, global_env
+
+
+__all__ = ['RatingTable', 'COLUMNS', 'to_record', 'from_record', 'chunks',
+           'write_csv', 'read_csv', 'load_csv', 'to_arrow', 'write_parquet',
+           'read_parquet', 'load_parquet']
+
+
+#: The columns of a rating table. ``rated_at`` is in seconds since the epoch
+#: and missing if the rating is not rated yet.
+COLUMNS = ('key', 'value', 'times', 'rated_at', 'stable')
+NAN = float('nan')
+
+
+def to_record(rating):
+    """Converts a rating to a ``(value, times, rated_at, stable)`` tuple.
+    ``rated_at`` is in seconds since the epoch or NaN.
+    """
+    rated_at = getattr(rating, 'rated_at', None)
+    return (float(rating), getattr(rating, 'times', None) or 0,
+            NAN if rated_at is None else (rated_at - EPOCH).total_seconds(),
+            bool(getattr(rating, 'stable', False)))
+
+
+def from_record(value, times, rated_at, stable, env=None):
+    """Makes a rating object of the environment's rating class of the
+    fields which :func:`to_record` returns. The fields the rating class
+    doesn't have are ignored.
+    """
+    if env is None:
+        env = global_env()
+    rating = env.create_rating(value)
+    if not hasattr(rating, 'value'):
+        return rating
+    if hasattr(rating, 'times'):
+        rating.times = times
+    if hasattr(rating, 'stable'):
+        rating.stable = bool(stable)
+    if hasattr(rating, 'rated_at'):
+        if rated_at == rated_at:
+            rating.rated_at = EPOCH + timedelta(seconds=rated_at)
+        else:
+            rating.rated_at = None
+    return rating
+
+
+class RatingTable(object):
+    """A chunk of ratings in columns. The columns other than the keys are
+    compact arrays, so a table can be loaded without making a rating object
+    for each row. Ratings without ``times``, ``rated_at`` or ``stable`` are
+    stored as ``0``, NaN and ``False``.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.values = array('d')
+        self.times = array('l')
+        #: Seconds since the epoch. NaN if the rating is not rated yet.
+        self.rated_at = array('d')
+        self.stable = array('b')
+
+    @classmethod
+    def from_ratings(cls, ratings):
+        """Makes a table of a dictionary or an iterable of ``(key, rating)``
+        tuples.
+        """
+        table = cls()
+        if hasattr(ratings, 'items'):
+            ratings = ratings.items()
+        for key, rating in ratings:
+            table.append(key, rating)
+        return table
+
+    def append(self, key, rating):
+        value, times, rated_at, stable = to_record(rating)
+        self.keys.append(key)
+        self.values.append(value)
+        self.times.append(times)
+        self.rated_at.append(rated_at)
+        self.stable.append(stable)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self):
+        """Iterates the rows as tuples in the order of :data:`COLUMNS`."""
+        return zip(self.keys, self.values, self.times, self.rated_at,
+                   self.stable)
+
+    def rating(self, index, env=None):
+        """Makes a rating object of the environment's rating class of a
+        row.
+        """
+        return from_record(self.values[index], self.times[index],
+                           self.rated_at[index], self.stable[index], env)
+
+    def decayed_values(self, env=None, at=None):
+        """Decays the values by :meth:`elo.Elo.decay_many` without making
+        rating objects. It requires NumPy.
+
+        :param at: the time to read at. The clock of the environment's rating
+                   class by default.
+        """
+        if env is None:
+            env = global_env()
+        if at is None:
+            at = getattr(env.rating_class, 'clock', datetime.utcnow)()
+        return env.decay_many(self.values, self.rated_at, at)
+
+    def ratings(self, env=None):
+        """Makes a dictionary of the rating objects by the keys."""
+        if env is None:
+            env = global_env()
+        return dict((key, self.rating(x, env))
+                    for x, key in enumerate(self.keys))
+
+
+def chunks(ratings, chunksize=4096):
+    """Splits a dictionary or an iterable of ``(key, rating)`` tuples into
+    tables of at most ``chunksize`` rows. The iterable is consumed lazily.
+    """
+    if hasattr(ratings, 'items'):
+        ratings = ratings.items()
+    table = RatingTable()
+    for key, rating in ratings:
+        table.append(key, rating)
+        if len(table) >= chunksize:
+            yield table
+            table = RatingTable()
+    if table:
+        yield table
+
+
+def write_csv(f, ratings, chunksize=4096):
+    """Writes ratings to a CSV file with a header of :data:`COLUMNS`. The
+    ratings are converted and written chunk by chunk, so the memory usage
+    doesn't grow with the number of the ratings. The values are written
+    without loss of precision.
+
+    :param f: a file object opened for writing, with ``newline=''`` on
+              Python 3.
+    :param ratings: a dictionary or an iterable of ``(key, rating)`` tuples.
+    """
+    writer = csv.writer(f)
+    writer.writerow(COLUMNS)
+    for table in chunks(ratings, chunksize):
+        writer.writerows(
+            (key, repr(value), times,
+             repr(rated_at) if rated_at == rated_at else '', int(stable))
+            for key, value, times, rated_at, stable in table.rows())
+
+
+def read_csv(f, chunksize=4096, key=str):
+    """Reads a CSV file which :func:`write_csv` wrote into tables of at most
+    ``chunksize`` rows. No rating objects are made.
+
+    :param key: the function which converts the keys from strings.
+    """
+    reader = csv.reader(f)
+    header = next(reader)
+    if tuple(header) != COLUMNS:
+        raise ValueError('Unknown columns: %r' % (header,))
+    table = RatingTable()
+    for row in reader:
+        table.keys.append(key(row[0]))
+        table.values.append(float(row[1]))
+        table.times.append(int(row[2]))
+        table.rated_at.append(float(row[3]) if row[3] else NAN)
+        table.stable.append(bool(int(row[4])))
+        if len(table) >= chunksize:
+            yield table
+            table = RatingTable()
+    if table:
+        yield table
+
+
+def load_csv(f, env=None, key=str):
+    """Loads a CSV file which :func:`write_csv` wrote as a dictionary of
+    rating objects of the environment's rating class.
+    """
+    ratings = {}
+    for table in read_csv(f, key=key):
+        ratings.update(table.ratings(env))
+    return ratings
+
+
+def to_arrow(table):
+    """Converts a table to a :class:`pyarrow.RecordBatch`. Missing
+    ``rated_at`` values are null. The keys of an empty table are strings.
+    """
+    return pyarrow.RecordBatch.from_arrays([
+        pyarrow.array(table.keys, None if table.keys else pyarrow.string()),
+        pyarrow.array(table.values, pyarrow.float64()),
+        pyarrow.array(table.times, pyarrow.int64()),
+        pyarrow.array(table.rated_at, pyarrow.float64(), from_pandas=True),
+        pyarrow.array([bool(x) for x in table.stable], pyarrow.bool_()),
+    ], list(COLUMNS))
+
+
+def write_parquet(path, ratings, chunksize=65536):
+    """Writes ratings to a Parquet file chunk by chunk. A chunk is a row
+    group. It requires :mod:`pyarrow`.
+
+    :param ratings: a dictionary or an iterable of ``(key, rating)`` tuples.
+    """
+    writer = None
+    try:
+        for table in chunks(ratings, chunksize):
+            batch = to_arrow(table)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+        if writer is None:
+            # no ratings. An empty file still has the schema.
+            batch = to_arrow(RatingTable())
+            writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_parquet(path, chunksize=65536):
+    """Reads a Parquet file which :func:`write_parquet` wrote into tables of
+    at most ``chunksize`` rows. It requires :mod:`pyarrow`.
+    """
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(chunksize, columns=list(COLUMNS)):
+        table = RatingTable()
+        # nulls become NaN, and the other columns have no nulls
+        columns = [batch.column(x).to_numpy(zero_copy_only=False)
+                   for x in range(len(COLUMNS))]
+        table.keys = columns[0].tolist()
+        table.values = array('d', columns[1].astype('d').tobytes())
+        table.times = array('l', columns[2].astype('l').tobytes())
+        table.rated_at = array('d', columns[3].astype('d').tobytes())
+        table.stable = array('b', columns[4].astype('b').tobytes())
+        yield table
+
+
+def load_parquet(path, env=None):
+    """Loads a Parquet file which :func:`write_parquet` wrote as a dictionary
+    of rating objects of the environment's rating class.
+    """
+    ratings = {}
+    for table in read_parquet(path):
+        ratings.update(table.ratings(env))
+    return ratings
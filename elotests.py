@@ -154,3 +154,1074 @@ def test_based_multiplayer_elo_calculator():
     assert fide25.k_factor(r1) == 15
     assert fide25.k_factor(r2) == 15
     assert almost(map(float, fide25.rate_1vs1(r2, r1))) == (813.636, 1186.364)
+
+
+def test_rate_1vs1_batch():
+    from array import array
+    ratings1 = [1200, 1500, 800, 2450]
+    ratings2 = [1400, 1200, 800, 2390]
+    scores = [WIN, LOSS, DRAW, WIN]
+    for env in [Elo(25), uscf]:
+        values1, values2 = env.rate_1vs1_batch(array('d', ratings1),
+                                               array('d', ratings2), scores)
+        assert isinstance(values1, array)
+        for x, (r1, r2, score) in enumerate(zip(ratings1, ratings2, scores)):
+            if score == LOSS:
+                r2, r1 = env.rate_1vs1(r2, r1)
+            else:
+                r1, r2 = env.rate_1vs1(r1, r2, drawn=(score == DRAW))
+            assert (values1[x], values2[x]) == (r1, r2)
+    # rating objects let a callable K-factor see their extra data
+    ratings1 = [fide25.create_rating(r, 40) for r in ratings1]
+    ratings2 = [fide25.create_rating(r, 0) for r in ratings2]
+    values1, values2 = fide25.rate_1vs1_batch(ratings1, ratings2, [WIN] * 4)
+    for x, (r1, r2) in enumerate(zip(ratings1, ratings2)):
+        r1, r2 = fide25.rate_1vs1(r1, r2)
+        assert (values1[x], values2[x]) == (float(r1), float(r2))
+    with raises(ValueError):
+        Elo(25).rate_1vs1_batch([1200, 1300, 1400], [1200], [WIN, WIN])
+    # NumPy may differ in the last bits
+    from pytest import importorskip
+    numpy = importorskip('numpy')
+    rng = numpy.random.default_rng(1989)
+    ratings1 = rng.uniform(800, 2400, 1000)
+    ratings2 = rng.uniform(800, 2400, 1000)
+    scores = rng.choice([WIN, DRAW, LOSS], 1000)
+    for env in [Elo(25), uscf]:
+        values1, values2 = env.rate_1vs1_batch(ratings1, ratings2, scores)
+        assert isinstance(values1, numpy.ndarray)
+        for x, (r1, r2, score) in enumerate(zip(ratings1.tolist(),
+                                                ratings2.tolist(),
+                                                scores.tolist())):
+            r1, r2 = env._rate_1vs1_by_score(r1, r2, score)
+            assert abs(values1[x] - r1) < 1e-9
+            assert abs(values2[x] - r2) < 1e-9
+
+
+def test_replay():
+    import random
+    rand = random.Random(1989)
+    keys = range(8)
+    log = [(rand.choice(keys), rand.choice(keys), rand.choice([WIN, DRAW, LOSS]))
+           for x in range(500)]
+    log = [(key1, key2, score) for key1, key2, score in log if key1 != key2]
+    for env in [Elo(25), fide30, fide25, uscf]:
+        ratings = dict((key, env.create_rating(2300 + key * 20))
+                       for key in keys)
+        replay = Replay(env)
+        for key in keys:
+            replay.add(key, ratings[key])
+        replay.run(log)
+        for key1, key2, score in log:
+            if score == LOSS:
+                ratings[key2], ratings[key1] = \
+                    env.rate_1vs1(ratings[key2], ratings[key1])
+            else:
+                ratings[key1], ratings[key2] = \
+                    env.rate_1vs1(ratings[key1], ratings[key2], score == DRAW)
+        for key in keys:
+            rating = replay.rating(key)
+            assert float(rating) == float(ratings[key])
+            assert getattr(rating, 'times', None) == \
+                getattr(ratings[key], 'times', None)
+            assert getattr(rating, 'stable', None) == \
+                getattr(ratings[key], 'stable', None)
+    # unknown players start with the initial rating
+    replay = Replay(Elo(25))
+    replay.run([('alice', 'bob', WIN)])
+    assert replay.value('alice') == 1212.5
+    assert replay.value('bob') == 1187.5
+
+
+def test_expect_table():
+    import random
+    rand = random.Random(1989)
+    exact = Elo(25)
+    env = Elo(25)
+    table = env.cache_expect(bound=2000, resolution=1.)
+    assert table.max_error < 1e-6
+    for x in range(1000):
+        r1, r2 = rand.uniform(0, 3000), rand.uniform(0, 3000)
+        assert abs(env.expect(r1, r2) - exact.expect(r1, r2)) <= table.max_error
+        assert abs(env.quality_1vs1(r1, r2) -
+                   exact.quality_1vs1(r1, r2)) <= 2 * table.max_error
+    # the exact formula out of the table
+    assert env.expect(0, 5000) == exact.expect(0, 5000)
+    # integer differences are exact on the table
+    assert env.expect(1200, 1400) == exact.expect(1200, 1400)
+    # the table is rebuilt when Beta changes
+    env.beta = exact.beta = 100
+    assert env.expect_table is not table
+    assert almost(env.expect(1200, 1400)) == exact.expect(1200, 1400)
+    env.expect_table = None
+    assert env.expect(1200, 1400) == exact.expect(1200, 1400)
+
+
+def test_expect_many():
+    from pytest import importorskip
+    numpy = importorskip('numpy')
+    diffs = numpy.array([[-5000., -200.5], [0., 123.25]])
+    for env in [Elo(25), Elo(25)]:
+        expects = env.expect_many(diffs)
+        assert expects.shape == diffs.shape
+        for diff, expect in zip(diffs.flat, expects.flat):
+            assert abs(expect - env.expect(0, diff)) < 1e-12
+        env.cache_expect(resolution=10.)
+    # the table is looked up
+    assert env.expect_many(diffs)[1, 1] == env.expect_table.expect(123.25)
+    assert env.expect_many(diffs)[1, 1] != Elo(25).expect(0, 123.25)
+
+    class HalfElo(Elo):
+        def expect(self, rating, other_rating):
+            return 0.5
+
+    assert HalfElo().expect_many(diffs).tolist() == [[0.5, 0.5], [0.5, 0.5]]
+    # the vectorized paths see the table as rate_1vs1 does
+    ratings1, ratings2 = numpy.array([1200., 1500.]), numpy.array([1320., 900.])
+    values1, values2 = env.rate_1vs1_batch(ratings1, ratings2, [WIN, LOSS])
+    for x in range(2):
+        rated = env.rate_1vs1(ratings1[x], ratings2[x], False)
+        if x:
+            rated = env.rate_1vs1(ratings2[x], ratings1[x])[::-1]
+        assert abs(values1[x] - rated[0]) < 1e-9
+        assert abs(values2[x] - rated[1]) < 1e-9
+    ratings = {1: 1200., 2: 1320.}
+    env.rate_period(ratings, [(1, 2, WIN)])
+    rated = env.rate_1vs1(1200., 1320.)
+    assert abs(ratings[1] - rated[0]) < 1e-9
+    assert abs(ratings[2] - rated[1]) < 1e-9
+
+
+def test_compact_rating():
+    from elopopulars import CompactFIDERating, FIDERating
+    pairs = [(Rating, CompactRating), (CountedRating, CompactCountedRating),
+             (TimedRating, CompactTimedRating),
+             (FIDERating, CompactFIDERating)]
+    for rating_class, compact_class in pairs:
+        assert not hasattr(compact_class(1200), '__dict__')
+        env = Elo(lambda r: 30 if r < 2400 else 10, rating_class)
+        compact_env = Elo(env.k_factor, compact_class)
+        r1, r2 = env.create_rating(2390), env.create_rating(1200)
+        c1, c2 = compact_env.create_rating(2390), compact_env.create_rating(1200)
+        for x in range(40):
+            r1, r2 = env.rate_1vs1(r1, r2)
+            c1, c2 = compact_env.rate_1vs1(c1, c2)
+            assert (float(r1), float(r2)) == (float(c1), float(c2))
+        for attr in ['times', 'stable']:
+            assert getattr(r1, attr, None) == getattr(c1, attr, None)
+    with raises(AttributeError):
+        CompactRating(1200).extra = True
+
+
+def test_inplace_rate():
+    from elopopulars import CompactFIDERating
+    env = Elo(fide30.k_factor, CompactFIDERating)
+    rating = env.create_rating(2390, 29)
+    rated = env.rate(rating, [(WIN, 2390)])
+    assert rated is not rating
+    assert rating == 2390 and rating.times == 29
+    same = env.rate(rating, [(WIN, 2390)], inplace=True)
+    assert same is rating
+    assert rating == rated
+    assert (rating.times, rating.stable) == (rated.times, rated.stable) == \
+           (30, True)
+    # immutable ratings are not affected
+    assert Elo().rate(1200., [(WIN, 1200)], inplace=True) == 1205
+
+
+def test_rate_rounds():
+    import random
+    from multiprocessing.pool import ThreadPool
+    rand = random.Random(1989)
+    keys = list(range(64))
+    rounds = []
+    for x in range(10):
+        rand.shuffle(keys)
+        scores = [rand.choice([WIN, DRAW, LOSS]) for y in range(32)]
+        rounds.append(list(zip(keys[::2], keys[1::2], scores)))
+    for env in [Elo(25), fide30]:
+        expected = dict((key, env.create_rating(1000 + key * 25))
+                        for key in keys)
+        for games in rounds:
+            for key1, key2, score in games:
+                if score == LOSS:
+                    expected[key2], expected[key1] = \
+                        env.rate_1vs1(expected[key2], expected[key1])
+                else:
+                    expected[key1], expected[key2] = env.rate_1vs1(
+                        expected[key1], expected[key2], score == DRAW)
+        pool = ThreadPool(4)
+        for kwargs in [{}, {'pool': pool, 'chunksize': 5}]:
+            ratings = dict((key, env.create_rating(1000 + key * 25))
+                           for key in keys)
+            assert env.rate_rounds(ratings, rounds, **kwargs) is ratings
+            for key in keys:
+                assert float(ratings[key]) == float(expected[key])
+                assert getattr(ratings[key], 'times', None) == \
+                    getattr(expected[key], 'times', None)
+        pool.close()
+    with raises(ValueError):
+        Elo().rate_rounds({1: 1200, 2: 1200, 3: 1200},
+                          [[(1, 2, WIN), (2, 3, WIN)]])
+    # unknown players start with the initial rating
+    env = Elo(25, CountedRating)
+    ratings = env.rate_rounds({}, [[(1, 2, WIN)], [(2, 3, DRAW)]])
+    assert sorted(ratings) == [1, 2, 3]
+    assert float(ratings[1]) == 1212.5 and ratings[2].times == 2
+    # the tasks carry only values, so a callable K-factor needn't be
+    # picklable, and a worker builds the expectation table itself
+    from multiprocessing import Pool
+    env = Elo(lambda rating: 40 if rating.times < 3 else 20, CountedRating)
+    env.cache_expect()
+    expected = env.rate_rounds({}, rounds)
+    pool = Pool(2)
+    try:
+        ratings = env.rate_rounds({}, rounds, pool=pool, chunksize=8)
+    finally:
+        pool.close()
+    for key in keys:
+        assert float(ratings[key]) == float(expected[key])
+        assert ratings[key].times == expected[key].times
+
+
+def test_rate_stream():
+    import itertools
+    env = Elo(25)
+    events = itertools.cycle([('alice', 'bob', WIN), ('bob', 'carol', DRAW),
+                              ('carol', 'alice', LOSS)])
+    ratings = {}
+    stream = env.rate_stream(ratings, events, batch_size=2)
+    batch = next(stream)
+    assert [key for key, old, new in batch] == ['alice', 'bob', 'bob', 'carol']
+    assert batch[0] == ('alice', 1200, 1212.5)
+    assert batch[2][1] == batch[1][2]
+    assert ratings == {'alice': 1212.5, 'bob': batch[2][2],
+                       'carol': batch[3][2]}
+    # the same as rating the games in order
+    expected = dict(ratings)
+    for x in range(100):
+        for key, old, new in next(stream):
+            assert float(old) == float(expected[key])
+            expected[key] = new
+    assert len(list(env.rate_stream({}, [('a', 'b', WIN)] * 5,
+                                    batch_size=2))) == 3
+
+
+def test_async_rate_stream():
+    import sys
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+    from eloaio import rate_stream
+    env = Elo(25)
+
+    async def events():
+        yield ('alice', 'bob', WIN)
+        yield ('bob', 'carol', DRAW)
+        await asyncio.sleep(0.2)
+        yield ('carol', 'alice', LOSS)
+
+    async def consume():
+        ratings = {}
+        batches = []
+        async for batch in rate_stream(ratings, events(), batch_size=10,
+                                       interval=0.05, env=env):
+            batches.append(batch)
+        return ratings, batches
+
+    ratings, batches = asyncio.run(consume())
+    # flushed by the interval while the source was idle
+    assert [len(batch) for batch in batches] == [4, 2]
+    expected = {}
+    for batch in env.rate_stream(expected, [('alice', 'bob', WIN),
+                                            ('bob', 'carol', DRAW),
+                                            ('carol', 'alice', LOSS)]):
+        pass
+    assert ratings == expected
+
+
+def test_leaderboard():
+    import random
+    from eloboard import Leaderboard
+    rand = random.Random(1989)
+    board = Leaderboard(Elo(25), lower=0, upper=3000, resolution=1)
+    for key in range(1000):
+        board[key] = rand.uniform(-100, 3100)
+    Elo(25).rate_rounds(board, [[(x, x + 1, WIN) for x in range(0, 1000, 2)]])
+    for x in range(100):
+        board.rate_1vs1(rand.randrange(1000), rand.randrange(1000))
+    buckets = dict((key, board.bucket(rating))
+                   for key, rating in board.ratings.items())
+    for key in range(0, 1000, 7):
+        higher = sum(1 for b in buckets.values() if b > buckets[key])
+        lower = sum(1 for b in buckets.values() if b < buckets[key])
+        assert board.rank(key) == higher + 1
+        assert board.percentile(key) == lower / 10.
+    assert board.count(1000, 2000) == \
+        sum(1 for b in buckets.values() if 1000 <= b <= 2000)
+    assert board.count(2000, 1000) == 0
+    top = board.top(20)
+    assert len(top) == 20
+    assert [key for key, rating in top] == \
+        sorted(board, key=lambda key: float(board[key]), reverse=True)[:20]
+    del board[top[0][0]]
+    assert board.top(1) == top[1:2]
+    assert len(board) == 999
+
+
+def test_match_queue():
+    import random
+    from elomatch import MatchQueue
+    rand = random.Random(1989)
+    env = Elo()
+    for quality in [0.2, 0.5, 0.9]:
+        diff = env.max_diff_1vs1(quality)
+        assert almost(env.quality_1vs1(1500, 1500 + diff)) == quality
+        assert almost(env.quality_1vs1(1500 + diff, 1500)) == quality
+    assert env.max_diff_1vs1(0) == float('inf')
+    assert env.max_diff_1vs1(1) == 0
+    queue = MatchQueue(env)
+    for key in range(200):
+        queue.add(key, rand.uniform(1000, 2000))
+    queue.remove(100)
+    assert 100 not in queue and len(queue) == 199
+    for key in range(0, 100, 3):
+        expected = max((k for k in queue.ratings if k != key),
+                       key=lambda k: env.quality_1vs1(queue.ratings[key],
+                                                      queue.ratings[k]))
+        assert queue.best_opponent(key) == expected
+        quality = env.quality_1vs1(queue.ratings[key], queue.ratings[expected])
+        assert queue.best_opponent(key, quality + 1e-3) is None
+    # the best pairing among all pairings of a small queue
+    queue = MatchQueue(env)
+    for key in range(8):
+        queue.add(key, rand.uniform(1000, 1500))
+    min_quality = 0.7
+
+    def score(pairs):
+        return (len(pairs), -sum(abs(queue.ratings[k1] - queue.ratings[k2])
+                                 for k1, k2 in pairs))
+
+    def matchings(keys):
+        if len(keys) < 2:
+            yield []
+            return
+        for matching in matchings(keys[1:]):
+            yield matching
+        for other in keys[1:]:
+            if env.quality_1vs1(queue.ratings[keys[0]],
+                                queue.ratings[other]) >= min_quality:
+                rest = [key for key in keys[1:] if key != other]
+                for matching in matchings(rest):
+                    yield [(keys[0], other)] + matching
+
+    best = max(map(score, matchings(list(range(8)))))
+    pairs = queue.pairs(min_quality)
+    assert len(pairs) == best[0]
+    assert almost(score(pairs)[1]) == best[1]
+
+
+def test_rating_store():
+    import os
+    import shutil
+    import tempfile
+    from elostore import RatingStore
+
+    class FIDETimedRating(fide30.rating_class, TimedRating):
+        pass
+    env = Elo(fide30.k_factor, FIDETimedRating)
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ratings')
+        store = RatingStore.create(path, 100, env=env)
+        assert len(store) == 100
+        assert store[99] == 1200 and store[99].rated_at is None
+        store[0] = env.create_rating(2390, 29)
+        store[1] = env.create_rating(2400)
+        expected = env.rate_1vs1(store[0], store[1])
+        store.rate_1vs1(0, 1)
+        for player_id, rating in enumerate(expected):
+            stored = store[player_id]
+            assert float(stored) == float(rating)
+            assert stored.times == rating.times
+            assert stored.stable == rating.stable
+            assert abs(stored.rated_at - rating.rated_at).total_seconds() < 1
+        assert store[0].stable
+        with raises(IndexError):
+            store[100]
+        store.flush()
+        # another process would share the same records
+        with RatingStore(path, env=env, readonly=True) as other:
+            assert float(other[0]) == float(expected[0])
+            assert other.value(1) == float(expected[1])
+            with raises(TypeError):
+                other[2] = env.create_rating()
+        store.close()
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 32)
+        with raises(ValueError):
+            RatingStore(path, env=env)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_rate_ffa():
+    import random
+    rand = random.Random(1989)
+    elo = Elo(10)
+    assert almost(elo.rate_ffa([1500, 1000, 2000], [1, 2, 3])) == \
+        (1510.000, 1009.436, 1980.564)
+    for env in [elo, uscf, fide25]:
+        ratings = [env.create_rating(rand.uniform(800, 2600))
+                   for x in range(100)]
+        placements = [rand.randrange(60) for x in range(100)]
+        new_ratings = env.rate_ffa(ratings, placements)
+        for x, (rating, placement) in enumerate(zip(ratings, placements)):
+            series = [(WIN if placement < other_placement else
+                       DRAW if placement == other_placement else LOSS,
+                       other_rating)
+                      for y, (other_rating, other_placement) in
+                      enumerate(zip(ratings, placements)) if x != y]
+            expected = env.rate(rating, series)
+            assert almost(float(new_ratings[x])) == float(expected)
+            assert type(new_ratings[x]) is type(expected)
+    with raises(ValueError):
+        elo.rate_ffa([1200, 1200], [1])
+
+
+def test_instrument():
+    calls = []
+    instrument = Instrument(callbacks=[lambda *args: calls.append(args)])
+    env = Elo(fide25.k_factor, fide25.rating_class)
+    expected = env.rate_1vs1(1200, 1500)
+    assert env.instrument(instrument) is env
+    assert env.instrumentation is instrument
+    assert env.rate_1vs1(1200, 1500) == expected
+    assert instrument.counts == {'rate_1vs1': 1, 'rate': 2, 'adjust': 2,
+                                 'expect': 2, 'k_factor': 2}
+    assert len(calls) == 9
+    exported = instrument.export()
+    assert exported['rate']['count'] == 2
+    assert sum(count for bound, count in exported['rate']['histogram']) == 2
+    assert exported['rate']['histogram'][-1][0] is None
+    assert 'k_factor=elopopulars.fide_k_factor' in repr(env)
+    # the global functions go through the instrumented environment
+    env.make_as_global()
+    try:
+        rate(1200, [(WIN, 1200)])
+        assert instrument.counts['rate'] == 3
+    finally:
+        setup()
+    env.uninstrument()
+    assert env.instrumentation is None
+    assert env.k_factor is fide25.k_factor
+    env.rate_1vs1(1200, 1500)
+    assert instrument.counts['rate_1vs1'] == 1
+
+
+def test_local_env():
+    import sys
+    env = Elo(25, initial=1500)
+    assert global_env() is not env
+    with env.make_as_local() as local_env:
+        assert local_env is env
+        assert global_env() is env
+        assert Rating() == 1500
+        assert rate_1vs1(1500, 1500) == (1512.5, 1487.5)
+        # the local environment takes precedence over the global one
+        setup(k_factor=50)
+        assert global_env() is env
+    assert global_env().k_factor == 50
+    assert rate_1vs1(1200, 1200) == (1225, 1175)
+    setup()
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+
+    async def task(initial):
+        Elo(initial=initial).make_as_local()
+        await asyncio.sleep(0.01)
+        return Rating()
+
+    async def main():
+        return await asyncio.gather(task(1000), task(2000))
+    assert asyncio.run(main()) == [1000, 2000]
+    assert Rating() == 1200
+
+
+def test_registry():
+    import threading
+    from eloregistry import Registry
+    registry = Registry(Elo(25, CountedRating), stripes=4)
+    keys = list(range(6))
+    games = 300
+
+    def play(offset, optimistic):
+        rate_1vs1 = (registry.rate_1vs1_optimistic if optimistic else
+                     registry.rate_1vs1)
+        for x in range(games):
+            key1 = keys[(x + offset) % len(keys)]
+            key2 = keys[(x * 7 + offset + 1) % len(keys)]
+            if key1 != key2:
+                rate_1vs1(key1, key2)
+            else:
+                registry.rate(key1, [(WIN, keys[(x + 2) % len(keys)])])
+    threads = [threading.Thread(target=play, args=(x, x % 2 == 0))
+               for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every update is counted, so no update is lost
+    played = 0
+    for offset in range(8):
+        for x in range(games):
+            key1 = keys[(x + offset) % len(keys)]
+            key2 = keys[(x * 7 + offset + 1) % len(keys)]
+            played += 2 if key1 != key2 else 1
+    assert sum(registry[key].times for key in registry) == played
+    assert len(registry) == len(keys)
+    registry['new'] = registry.env.create_rating(1500, 10)
+    assert registry.get('new').times == 10
+    assert registry.get('unknown') is None
+    # another thread always changes the rating during the calculation
+    registry.env = Elo(25, CountedRating)
+    original = registry.env.rate_1vs1
+
+    def conflicting_rate_1vs1(*args):
+        registry['new'] = registry['new']
+        return original(*args)
+    registry.env.rate_1vs1 = conflicting_rate_1vs1
+    with raises(RuntimeError):
+        registry.rate_1vs1_optimistic('new', 0, retries=3)
+
+
+def test_rating_service():
+    import sys
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+    import os
+    import random
+    import shutil
+    import tempfile
+    from eloaio import MemoryBackend, RatingService, SQLiteBackend
+    rand = random.Random(1989)
+    env = Elo(25, CountedRating)
+    games = [(rand.randrange(20), rand.randrange(20), rand.random() < 0.1)
+             for x in range(500)]
+    games = [game for game in games if game[0] != game[1]]
+    expected = {}
+    for key1, key2, drawn in games:
+        expected[key1], expected[key2] = env.rate_1vs1(
+            expected.get(key1, env.create_rating()),
+            expected.get(key2, env.create_rating()), drawn)
+
+    async def run(backend):
+        service = RatingService(backend, env, max_batch=64)
+        # the requests are made in order but served concurrently
+        results = await asyncio.gather(*[service.rate_1vs1(*game)
+                                         for game in games])
+        await service.drain()
+        assert len(results) == len(games)
+        ratings = await backend.read(list(expected))
+        for key, rating in expected.items():
+            assert float(ratings[key]) == float(rating)
+            assert ratings[key].times == rating.times
+            assert float(await service.get(key)) == float(rating)
+        assert await service.get('unknown') is None
+
+    asyncio.run(run(MemoryBackend()))
+    tmp = tempfile.mkdtemp()
+    try:
+        backend = SQLiteBackend(os.path.join(tmp, 'ratings.db'))
+        asyncio.run(run(backend))
+        asyncio.run(backend.close())
+    finally:
+        shutil.rmtree(tmp)
+
+    class BrokenBackend(MemoryBackend):
+        async def write(self, ratings):
+            raise IOError('Broken')
+
+    async def fail():
+        service = RatingService(BrokenBackend(), env)
+        with raises(IOError):
+            await service.rate_1vs1('alice', 'bob')
+        await service.drain()
+        assert await service.get('alice') is None
+
+    asyncio.run(fail())
+
+    class FlakyBackend(MemoryBackend):
+        failures = 1
+        async def write(self, ratings):
+            if self.failures:
+                self.failures -= 1
+                raise IOError('Transient')
+            await MemoryBackend.write(self, ratings)
+
+    async def recover():
+        backend = FlakyBackend()
+        service = RatingService(backend, env)
+        with raises(IOError):
+            await service.rate_1vs1('alice', 'bob')
+        # the next request is rated on the stored ratings and written
+        rated = await service.rate_1vs1('carol', 'dave')
+        await service.drain()
+        assert backend.ratings == {'carol': rated[0], 'dave': rated[1]}
+
+    asyncio.run(recover())
+
+    async def isolate():
+        # a broken rating fails only its game in a coalesced batch
+        backend = MemoryBackend({'mallory': 'broken'})
+        service = RatingService(backend, env)
+        results = await asyncio.gather(service.rate_1vs1('alice', 'bob'),
+                                       service.rate_1vs1('mallory', 'carol'),
+                                       service.rate_1vs1('alice', 'dave'),
+                                       return_exceptions=True)
+        await service.drain()
+        assert service._batches == 1
+        assert isinstance(results[1], ValueError)
+        assert backend.ratings == {'mallory': 'broken',
+                                   'alice': results[2][0],
+                                   'bob': results[0][1],
+                                   'dave': results[2][1]}
+
+    asyncio.run(isolate())
+
+
+def test_incremental_replay():
+    import random
+    rand = random.Random(1989)
+    keys = range(30)
+    log = [(rand.choice(keys), rand.choice(keys), rand.choice([WIN, DRAW, LOSS]))
+           for x in range(600)]
+    log = [game for game in log if game[0] != game[1]]
+    for env in [Elo(25), fide30]:
+        replay = IncrementalReplay(env)
+        for key in keys:
+            replay.add(key, env.create_rating(2300 + key * 5))
+        replay.run(log)
+        corrected = list(log)
+        for x in range(10):
+            position = rand.randrange(len(log))
+            if x % 3 == 0:
+                replay.void(position)
+                corrected[position] = None
+            else:
+                score = rand.choice([WIN, DRAW, LOSS])
+                replay.correct(position, score)
+                corrected[position] = corrected[position][:2] + (score,)
+            expected = Replay(env)
+            for key in keys:
+                expected.add(key, env.create_rating(2300 + key * 5))
+            expected.run(game for game in corrected if game is not None)
+            assert list(replay.values) == list(expected.values)
+            assert list(replay.times) == list(expected.times)
+            assert list(replay.stable) == list(expected.stable)
+
+
+def test_rate_period():
+    import random
+    rand = random.Random(1989)
+    keys = range(40)
+    games = [(rand.choice(keys), rand.choice(keys),
+              rand.choice([WIN, DRAW, LOSS])) for x in range(400)]
+    games = [game for game in games if game[0] != game[1]]
+    for env in [Elo(25), uscf, fide30]:
+        ratings = dict((key, env.create_rating(2100 + key * 10, 25))
+                       if env is fide30 else (key, 2100 + key * 10)
+                       for key in keys if key != 0)
+        before = dict(ratings)
+        assert env.rate_period(ratings, games) is ratings
+        before[0] = env.create_rating()
+        for key in keys:
+            series = [(score, before[key2] if key1 == key else before[key1])
+                      for key1, key2, score in games if key in (key1, key2)
+                      for score in [score if key1 == key else WIN - score]]
+            expected = env.rate(before[key], series)
+            # NumPy's power may differ from math's in the last bits
+            assert abs(float(ratings[key]) - float(expected)) < 1e-9
+            assert getattr(ratings[key], 'times', None) == \
+                getattr(expected, 'times', None)
+
+
+def test_speedups():
+    import random
+    import elo
+    if elo._elospeedups is None:
+        return
+    rand = random.Random(1989)
+    for env in [Elo(25, CountedRating, beta=173.7), fide30, uscf]:
+        for x in range(1000):
+            rating = env.create_rating(rand.uniform(0, 3000))
+            series = [(rand.choice([WIN, DRAW, LOSS, 1]),
+                       rand.uniform(0, 3000)) for y in range(x % 10)]
+            results = []
+            for speedups in [True, False]:
+                env.speedups = speedups
+                results.append((env.adjust(rating, series),
+                                float(env.rate(rating, series))))
+                if series:
+                    results[-1] += (env.expect(rating, series[0][1]),)
+            del env.speedups
+            # bit for bit
+            assert repr(results[0]) == repr(results[1])
+    env = Elo()
+    assert env.speedups
+    with raises(OverflowError):
+        env.expect(0, 1e6)
+    with raises(ValueError):
+        env.adjust(1200, [(WIN,)])
+
+
+def test_rating_table():
+    from datetime import datetime
+    import io
+    from elotable import load_csv, read_csv, write_csv
+    for env in [Elo(25), Elo(25, CountedRating), Elo(25, TimedRating),
+                Elo(25, CompactTimedRating), fide30]:
+        ratings = {}
+        for x in range(10):
+            ratings[str(x)] = env.create_rating(2380 + x * 3.1)
+        for x in range(0, 30, 3):
+            ratings[str(x % 10)], ratings[str(x % 7)] = env.rate_1vs1(
+                ratings[str(x % 10)], ratings[str(x % 7)])
+        if hasattr(ratings['0'], 'rated_at'):
+            ratings['0'].rated_at = datetime(2012, 1, 2, 3, 4, 5, 678901)
+        f = io.StringIO()
+        write_csv(f, ratings, chunksize=3)
+        f.seek(0)
+        tables = list(read_csv(f, chunksize=4))
+        assert [len(table) for table in tables] == [4, 4, 2]
+        assert sorted(tables[0].keys + tables[1].keys + tables[2].keys) == \
+            sorted(ratings)
+        assert all(tables[0].values[x] == float(ratings[key])
+                   for x, key in enumerate(tables[0].keys))
+        f.seek(0)
+        loaded = load_csv(f, env)
+        assert sorted(loaded) == sorted(ratings)
+        for key, rating in ratings.items():
+            assert type(loaded[key]) is type(rating)
+            assert float(loaded[key]) == float(rating)
+            for attr in ['times', 'rated_at', 'stable']:
+                assert getattr(loaded[key], attr, None) == \
+                    getattr(rating, attr, None)
+
+
+def test_rating_table_parquet():
+    from datetime import datetime
+    import os
+    import shutil
+    import tempfile
+    from pytest import importorskip
+    pyarrow = importorskip('pyarrow')
+    import pyarrow.parquet
+    from elotable import (COLUMNS, RatingTable, load_parquet, read_parquet,
+                          to_arrow, write_parquet)
+    env = Elo(25, TimedRating)
+    ratings = dict((x, env.create_rating(1200 + x * 3.1)) for x in range(10))
+    ratings[0].rated_at = datetime(2012, 1, 2, 3, 4, 5, 678901)
+    batch = to_arrow(RatingTable.from_ratings(ratings))
+    assert batch.schema.names == list(COLUMNS)
+    assert batch.column(3).null_count == 9
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'ratings.parquet')
+        write_parquet(path, ratings, chunksize=4)
+        tables = list(read_parquet(path, chunksize=4))
+        assert [len(table) for table in tables] == [4, 4, 2]
+        loaded = load_parquet(path, env)
+        assert sorted(loaded) == sorted(ratings)
+        for key, rating in ratings.items():
+            assert float(loaded[key]) == float(rating)
+            assert loaded[key].rated_at == rating.rated_at
+        assert tables[0].keys == [0, 1, 2, 3]
+        assert tables[0].values.typecode == 'd'
+        assert tables[0].times.typecode == 'l'
+        assert tables[0].rated_at[1] != tables[0].rated_at[1]
+        # an empty file has the schema and no rows
+        write_parquet(path, {})
+        assert pyarrow.parquet.read_schema(path).names == list(COLUMNS)
+        assert list(read_parquet(path)) == []
+        assert load_parquet(path, env) == {}
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_rating_repr():
+    assert repr(Rating(1500)) == 'elo.Rating(1500.000)'
+    assert repr(CountedRating(1500, 3)) == \
+        'elo.CountedRating(1500.000, times=3)'
+    assert repr(fide30.create_rating(2400, 30, True)) == \
+        'elopopulars.FIDERating(2400.000, times=30, stable=True)'
+    class CustomRating(CountedRating):
+        def __init__(self, value=None, times=0, level=1):
+            self.level = level
+            super(CustomRating, self).__init__(value, times)
+    assert repr(CustomRating(1500)).endswith('(1500.000, times=0, level=1)')
+    env = Elo(rating_class=CountedRating)
+    rating = CountedRating(1500)
+    assert env.ensure_rating(rating) is rating
+    assert type(env.ensure_rating(1500)) is CountedRating
+
+
+def test_simulate():
+    from pytest import importorskip
+    importorskip('numpy')
+    import itertools
+    from elosim import simulate_bracket, simulate_swiss
+    env = Elo(32)
+    ratings = [2000, 1800, 1650, 1700]
+    # the exact chances to win by enumerating the results
+    chances = [0.] * 4
+    for results in itertools.product([True, False], repeat=3):
+        values, finalists, p = list(map(float, ratings)), [], 1.
+        for x, won in zip([0, 2], results):
+            winner, loser = (x, x + 1) if won else (x + 1, x)
+            expect = env.expect(values[x], values[x + 1])
+            p *= expect if won else 1 - expect
+            values[winner] = env.rate_1vs1(values[winner], values[loser])[0]
+            finalists.append(winner)
+        expect = env.expect(values[finalists[0]], values[finalists[1]])
+        p *= expect if results[2] else 1 - expect
+        chances[finalists[0] if results[2] else finalists[1]] += p
+    odds = simulate_bracket(ratings, 100000, env, seed=1989)
+    assert odds.shape == (4, 3)
+    assert all(abs(odds[x, 2] - chances[x]) < 0.01 for x in range(4))
+    assert (odds.sum(axis=1) == 1).all()
+    # reproducible in any chunks by the seed
+    assert (simulate_bracket(ratings, 100, env, seed=1) ==
+            simulate_bracket(ratings, 100, env, seed=1)).all()
+    with raises(ValueError):
+        simulate_bracket(ratings[:3], 100, env)
+    with raises(ValueError):
+        simulate_bracket(ratings[:4], 0, env)
+    with raises(ValueError):
+        simulate_swiss(ratings[:4], 3, 0, env)
+    # a piecewise K-factor is vectorized with the same results
+    from elofit import PiecewiseK
+    piecewise = Elo(PiecewiseK([32, 24, 16], [1700, 1900]))
+    stepped = Elo(lambda r: 32 if r < 1700 else 24 if r < 1900 else 16)
+    assert (simulate_bracket(ratings, 1000, piecewise, seed=1) ==
+            simulate_bracket(ratings, 1000, stepped, seed=1)).all()
+    places = simulate_swiss(ratings + [1500], 3, 1000, fide30, draw_rate=0.3,
+                            seed=1989)
+    assert places.shape == (5, 5)
+    assert abs(places.sum(axis=0) - 1).max() < 1e-9
+    assert abs(places.sum(axis=1) - 1).max() < 1e-9
+    assert places[:, 0].argmax() == 0
+
+
+def test_fit():
+    from pytest import importorskip
+    importorskip('numpy')
+    import math
+    import random
+    import shutil
+    import tempfile
+    import elofit
+    from elofit import MatchLog, PiecewiseK, evaluate, fit, grid
+    rand = random.Random(1989)
+    strengths = [rand.gauss(1500, 300) for x in range(50)]
+    games = []
+    for x in range(3000):
+        key1, key2 = rand.sample(range(50), 2)
+        expect = 1. / (1 + 10 ** ((strengths[key2] - strengths[key1]) / 400.))
+        games.append((key1, key2, WIN if rand.random() < expect else LOSS))
+    log = MatchLog.encode(games)
+    for k_factor in [20, PiecewiseK([32, 24, 16], [1500, 1800]),
+                     PiecewiseK([20, 10], [1600], 40, 10)]:
+        # the same as rating the games by Elo.rate_1vs1
+        env = Elo(k_factor, CountedRating, 1400, 180)
+        ratings, log_loss, brier = {}, 0., 0.
+        for x, (key1, key2, score) in enumerate(games):
+            rating1 = ratings.get(key1, env.create_rating())
+            rating2 = ratings.get(key2, env.create_rating())
+            if x >= 2400:
+                expect = env.expect(rating1, rating2)
+                log_loss -= score * math.log(expect) + \
+                    (1 - score) * math.log(1 - expect)
+                brier += (expect - score) ** 2
+            ratings[key1], ratings[key2] = \
+                env._rate_1vs1_by_score(rating1, rating2, score)
+        result = evaluate(log, k_factor, 180, 1400, holdout=0.2)
+        assert result['games'] == 600
+        assert abs(result['log_loss'] - log_loss / 600) < 1e-9
+        assert abs(result['brier'] - brier / 600) < 1e-9
+        speedups, elofit._elospeedups = elofit._elospeedups, None
+        try:
+            assert evaluate(log, k_factor, 180, 1400, holdout=0.2) == result
+        finally:
+            elofit._elospeedups = speedups
+    assert 'k_factor=PiecewiseK([32, 24, 16], [1500, 1800])' in \
+        repr(Elo(PiecewiseK([32, 24, 16], [1500, 1800])))
+    tmp = tempfile.mkdtemp()
+    try:
+        log.save(tmp)
+        loaded = MatchLog.load(tmp)
+        assert loaded.keys == log.keys
+        candidates = grid(k_factor=[5, 20, 80], beta=[100, 200])
+        results = fit(loaded, candidates)
+        assert len(results) == 6
+        assert results[0][1]['log_loss'] <= results[-1][1]['log_loss']
+        assert results[0][1] == evaluate(log, holdout=0.2, **results[0][0])
+        # the loaded log is cached by the path
+        elofit._logs.clear()
+        fit(loaded, candidates)
+        fit(loaded, candidates)
+        assert list(elofit._logs) == [tmp]
+        elofit._logs.clear()
+        del loaded
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_pairwise_matrix():
+    from pytest import importorskip
+    numpy = importorskip('numpy')
+    import os
+    import random
+    import shutil
+    import tempfile
+    from elomatrix import expect_matrix, quality_matrix, quality_pairs
+    rand = random.Random(1989)
+    ratings = [rand.gauss(1500, 300) for x in range(300)]
+    for env in [Elo(), Elo(beta=150)]:
+        expects = expect_matrix(ratings, env, block_size=64)
+        qualities = quality_matrix(ratings, env, block_size=100)
+        for x in range(0, 300, 7):
+            for y in range(0, 300, 11):
+                assert abs(expects[x, y] -
+                           env.expect(ratings[x], ratings[y])) < 1e-12
+                assert abs(qualities[x, y] -
+                           env.quality_1vs1(ratings[x], ratings[y])) < 1e-12
+        for min_quality in [0, 0.5, 0.95]:
+            rows, cols, found = quality_pairs(ratings, min_quality, env,
+                                              block_size=500)
+            upper = numpy.triu_indices(300, 1)
+            expected = qualities[upper] >= min_quality
+            assert sorted(zip(rows.tolist(), cols.tolist())) == sorted(zip(
+                upper[0][expected].tolist(), upper[1][expected].tolist()))
+            assert abs(found - qualities[rows, cols]).max() < 1e-12
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'expects.npy')
+        expect_matrix(ratings, out=path, dtype=numpy.float32, block_size=64)
+        assert abs(numpy.load(path) - expect_matrix(ratings)).max() < 1e-6
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_decay():
+    from datetime import datetime, timedelta
+    from pytest import importorskip
+    from elotable import RatingTable
+    now = datetime(2012, 6, 1)
+    class ClockedRating(TimedRating):
+        clock = staticmethod(lambda: now)
+    env = Elo(25, ClockedRating)
+    env.decay = ExponentialDecay(timedelta(days=30), mean=1500,
+                                 grace=timedelta(days=7))
+    ratings = [ClockedRating(1900, now - timedelta(days=37)),
+               ClockedRating(1300, now - timedelta(days=97)),
+               ClockedRating(1800, now - timedelta(days=3)),
+               ClockedRating(1700)]
+    # what an eager sweep produces
+    swept = [1700., 1475., 1800., 1700.]
+    for rating, value in zip(ratings, swept):
+        assert abs(env.decayed(rating) - value) < 1e-9
+    # decaying in steps is the same as decaying at once without grace
+    decay = ExponentialDecay(timedelta(days=30), mean=1500)
+    day = 86400
+    assert abs(decay(decay(1300, 40 * day), 50 * day) -
+               decay(1300, 90 * day)) < 1e-9
+    # rated on the decayed values
+    rated1, rated2 = env.rate_1vs1(ratings[0], ratings[1])
+    expected = Elo(25).rate_1vs1(swept[0], swept[1])
+    assert abs(float(rated1) - expected[0]) < 1e-9
+    assert abs(float(rated2) - expected[1]) < 1e-9
+    assert rated1.rated_at == now and env.decayed(rated1) == float(rated1)
+    # the K-factor sees the decayed rating
+    uscf_env = Elo(uscf.k_factor, ClockedRating)
+    uscf_env.decay = env.decay
+    idle = ClockedRating(2110, now - timedelta(days=37))
+    eager = ClockedRating(uscf_env.decayed(idle), now)
+    assert float(eager) < 2100
+    assert abs(float(uscf_env.rate(idle, [(WIN, 1800)])) -
+               float(uscf_env.rate(eager, [(WIN, 1800)]))) < 1e-9
+    # the bulk paths decay as rate does
+    games = [(0, 1, WIN)]
+    rated = env.rate_period(dict(enumerate(ratings[:2])), games)
+    assert abs(float(rated[0]) - float(env.rate(
+        ratings[0], [(WIN, ratings[1])]))) < 1e-9
+    rated = env.rate_ffa(ratings[:2], [1, 2])
+    assert abs(float(rated[0]) - float(rated1)) < 1e-9
+    values1, values2 = env.rate_1vs1_batch(ratings[:1], ratings[1:2], [WIN])
+    assert abs(values1[0] - float(rated1)) < 1e-9
+    with raises(ValueError):
+        Replay(env)
+    # the bulk path for exports
+    importorskip('numpy')
+    table = RatingTable.from_ratings(enumerate(ratings))
+    decayed = table.decayed_values(env)
+    assert abs(decayed - swept).max() < 1e-9
+
+
+def test_rating_history():
+    from datetime import datetime, timedelta
+    from elohistory import RatingHistory
+    start = datetime(2012, 1, 1)
+    history = RatingHistory(chunk_size=4)
+    values = [1200 + 10 * math.sin(x) for x in range(50)]
+    for x, value in enumerate(values):
+        history.record('alice', value, start + timedelta(hours=x))
+    # point-in-time queries across sealed chunks and the open chunk
+    assert history.at('alice', start - timedelta(hours=1)) is None
+    assert history.at('bob', start) is None
+    for x, value in enumerate(values):
+        at = start + timedelta(hours=x, minutes=30)
+        assert abs(history.at('alice', at) - value) <= 0.0005
+    entries = history.range('alice', start + timedelta(hours=9),
+                            start + timedelta(hours=13))
+    assert [at for at, value in entries] == \
+        [start + timedelta(hours=x) for x in range(9, 14)]
+    assert len(history.range('alice')) == 50
+    assert history.nbytes < 50 * 16
+    with raises(ValueError):
+        history.record('alice', 1200, start)
+    # recorded by the environment with the player keys
+    env = Elo(25)
+    env.history = RatingHistory()
+    ratings = {}
+    list(env.rate_stream(ratings, [('alice', 'bob', WIN)]))
+    rated = env.rate(ratings['bob'], [(WIN, ratings['alice'])], key='bob')
+    assert set(env.history) == set(['alice', 'bob'])
+    assert len(env.history.range('bob')) == 2
+    assert abs(env.history.at('bob', datetime.utcnow()) - rated) < 0.001
+    # the tasks of a process pool don't carry the history
+    import pickle
+    assert pickle.loads(pickle.dumps(env)).history is None
+    assert env.instrument().history is not None
+    copied = pickle.loads(pickle.dumps(env))
+    assert copied.instrumentation is None and copied.k_factor == 25
+    env.uninstrument()
+    # the committed ratings of the other keyed paths
+    from eloregistry import Registry
+    registry = Registry(env)
+    registry.rate_1vs1_optimistic('carol', 'dave')
+    assert 'carol' in env.history and 'dave' in env.history
+    import sys
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+    from eloaio import MemoryBackend, RatingService
+    service = RatingService(MemoryBackend(), env)
+
+    async def rate():
+        await service.rate_1vs1('erin', 'frank')
+
+    asyncio.run(rate())
+    assert 'erin' in env.history and 'frank' in env.history
@@ -28,7 +28,7 @@ See Also
 """
 from __future__ import with_statement
 import re
-from setuptools import setup
+from setuptools import Extension, setup
 from setuptools.command.test import test
 import sys
 
@@ -57,7 +57,12 @@ setup(
     description='A rating system for chess tournaments',
     long_description=__doc__,
     platforms='any',
-    py_modules=['elo'],
+    py_modules=['elo', 'elopopulars', 'eloaio', 'eloboard', 'elomatch',
+                'elostore', 'eloregistry', 'elotable', 'elosim', 'elofit',
+                'elomatrix', 'elohistory'],
+    # the optional C speedups. elo works without them if they can't be built.
+    ext_modules=[Extension('_elospeedups', ['_elospeedups.c'],
+                           optional=True)],
     classifiers=['Development Status :: 1 - Planning',
                  'Intended Audience :: Developers',
                  'License :: OSI Approved :: BSD License',
@@ -74,6 +79,9 @@ setup(
                  'Programming Language :: Python :: Implementation :: CPython',
                  'Programming Language :: Python :: Implementation :: PyPy',
                  'Topic :: Games/Entertainment'],
+    # NumPy runs the vectorized paths and elosim, elofit and elomatrix.
+    # PyArrow runs the Arrow and Parquet paths of elotable.
+    extras_require={'numpy': ['numpy'], 'arrow': ['pyarrow']},
     test_suite='elotests',
     tests_require=['pytest', 'almost'],
     use_2to3=(sys.version_info[0] >= 3),